@@ -0,0 +1,483 @@
+"""
+Benchmarks for the scoring, ranking, priority and export hot paths.
+
+Runs entirely offline against the in-memory state store (nothing is written
+to surf_judge.db), first calling the functions directly and then the routes
+through the Flask test client. Heats are realistic: sparse and full 20-wave
+grids, every interference code, more heats than stay resident, and a large
+session tracker.
+
+    python benchmark.py                   # print latency percentiles and throughput
+    python benchmark.py --check           # exit 1 when slower than the stored baseline
+    python benchmark.py --save-baseline   # store this machine's numbers as the baseline
+    python benchmark.py --filter http.    # only benchmarks whose name contains "http."
+
+Baselines are machine-specific: record them on the box that runs --check.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Never touch the real heat database or journal
+os.environ['SURF_JUDGE_STATE'] = 'memory'
+os.environ.pop('SURF_JUDGE_JOURNAL', None)
+
+import surf_judge_pro as sjp
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_THRESHOLD = 0.30   # Fail when p50 is more than 30% slower than the baseline
+DEFAULT_MIN_DELTA_MS = 0.02  # ...and at least this much slower (ignores timer noise)
+
+benchmarks = []  # (name, make) in registration order; make() -> (fn, rounds)
+
+def benchmark(name, rounds=2000):
+    """Register a benchmark. The decorated function sets up state and returns
+    the callable to time; each call of that callable is one measured sample."""
+    def register(make):
+        benchmarks.append((name, lambda: (make(), rounds)))
+        return make
+    return register
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an ascending list"""
+    rank = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples) + 0.5)) - 1))
+    return samples[rank]
+
+def run(fn, rounds, warmup=20):
+    """Time rounds calls of fn and summarize them in milliseconds"""
+    for _ in range(min(warmup, rounds)):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        t0 = time.perf_counter_ns()
+        fn()
+        samples.append((time.perf_counter_ns() - t0) / 1e6)
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return {
+        'rounds': rounds,
+        'p50_ms': percentile(samples, 50),
+        'p90_ms': percentile(samples, 90),
+        'p99_ms': percentile(samples, 99),
+        'max_ms': samples[-1],
+        'ops_per_s': rounds / elapsed if elapsed else 0.0,
+    }
+
+# ---------------------------------------------------------------------------
+# Heat fixtures
+# ---------------------------------------------------------------------------
+
+rng = random.Random(2024)
+
+def random_score():
+    # Judges score in tenths, with the odd half-point or hundredth from averaging
+    return round(rng.choice((rng.randint(0, 100) / 10, rng.randint(0, 20) / 2, rng.uniform(0, 10))), 2)
+
+def fill_heat(data, waves_per_surfer, interference=True):
+    """Score the first waves_per_surfer waves of every surfer; spread the interference codes"""
+    for idx, surfer in enumerate(data.surfers):
+        for wave_idx in range(min(waves_per_surfer, data.wave_cap)):
+            surfer.waves[wave_idx] = random_score()
+        if interference:
+            surfer.interference = idx % 7
+            surfer.interference_waves = [0] if surfer.interference else []
+    return data
+
+def heat_state(surfer_count, wave_cap, waves_per_surfer):
+    return sjp.HeatState('bench', 1, fill_heat(sjp.new_heat(surfer_count, wave_cap), waves_per_surfer))
+
+def score_ops(surfer_count, wave_cap, waves_per_surfer):
+    """Batch operations that score a heat and set every interference code"""
+    ops = []
+    for idx in range(surfer_count):
+        for wave_idx in range(waves_per_surfer):
+            ops.append({'op': 'set_score', 'surfer_idx': idx, 'wave_idx': wave_idx, 'score': random_score()})
+        ops.append({'op': 'set_interference', 'surfer_idx': idx, 'interference': idx % 7})
+    return ops
+
+tracker_installed = False
+
+def install_tracker(athletes=500, heats_each=30):
+    """Record heats_each closed heats for each of athletes athletes (once per run)"""
+    global tracker_installed
+    if tracker_installed:
+        return
+    entries = []
+    for n in range(athletes):
+        goal = rng.choice((0, 10, 12, 14, 16))
+        for heat in range(heats_each):
+            waves = [random_score() for _ in range(rng.randint(2, 10))]
+            entries.append({'name': f'Surfer {n:04d}', 'goal': goal, 'heat_id': f'session-{heat:03d}',
+                            'heat_number': str(heat + 1), 'category': 'Open', 'round': 'R1',
+                            'position': rng.randint(1, 5), 'color': 'Red', 'waves': waves,
+                            'total': sum(sorted(waves)[-2:]), 'closed_at': None})
+    with sjp.state_store.transaction() as txn:
+        txn.record_results(entries)
+    tracker_installed = True
+
+# ---------------------------------------------------------------------------
+# Ranking engine and priority (direct calls)
+# ---------------------------------------------------------------------------
+
+def edit_and_rank(heat):
+    surfers = len(heat.data.surfers)
+    cap = heat.data.wave_cap
+    def step():
+        heat.engine.set_wave(rng.randrange(surfers), rng.randrange(cap), random_score())
+        sjp.calculate_rankings(heat)
+    return step
+
+@benchmark('rank.edit_sparse_5x20')
+def _():
+    return edit_and_rank(heat_state(5, 20, 3))
+
+@benchmark('rank.edit_full_6x20')
+def _():
+    return edit_and_rank(heat_state(6, 20, 20))
+
+@benchmark('rank.interference_full_6x20')
+def _():
+    heat = heat_state(6, 20, 20)
+    def step():
+        heat.engine.set_interference(rng.randrange(6), rng.randrange(7))
+        sjp.calculate_rankings(heat)
+    return step
+
+@benchmark('rank.rebuild_full_6x20', rounds=1000)
+def _():
+    heat = heat_state(6, 20, 20)
+    return lambda: (heat.engine.rebuild(), sjp.calculate_rankings(heat))
+
+def panel_heat(surfer_count, wave_cap, waves_per_surfer, judges=5):
+    """A heat scored by a full judging panel"""
+    heat = heat_state(surfer_count, wave_cap, 0)
+    heat.data.metadata['judges'] = judges
+    for op in score_ops(surfer_count, wave_cap, waves_per_surfer):
+        if op['op'] == 'set_score':
+            for judge in range(judges):
+                sjp.apply_operation(heat, dict(op, op='set_judge_score', judge=judge, score=random_score()))
+    return heat
+
+@benchmark('rank.judge_entry_full_6x20')
+def _():
+    heat = panel_heat(6, 20, 20)
+    def step():
+        sjp.apply_operation(heat, {'op': 'set_judge_score', 'surfer_idx': rng.randrange(6),
+                                   'wave_idx': rng.randrange(20), 'judge': rng.randrange(5),
+                                   'score': random_score()})
+        sjp.calculate_rankings(heat)
+    return step
+
+@benchmark('rank.panel_reaggregate_full_6x20', rounds=500)
+def _():
+    heat = panel_heat(6, 20, 20)
+    def step():
+        sjp.apply_operation(heat, {'op': 'update_metadata',
+                                   'metadata': {'aggregation': rng.choice(sjp.AGGREGATIONS)}})
+        sjp.calculate_rankings(heat)
+    return step
+
+@benchmark('rank.read_unchanged_5x20')
+def _():
+    heat = heat_state(5, 20, 8)
+    return lambda: sjp.calculate_rankings(heat)
+
+@benchmark('priority.build_6')
+def _():
+    heat = heat_state(6, 20, 4)
+    heat.data.priority_order = [0, 3, 5]
+    return lambda: sjp.build_priority_display(heat)
+
+# ---------------------------------------------------------------------------
+# Routes through the Flask test client
+# ---------------------------------------------------------------------------
+
+client = sjp.app.test_client()
+
+def ok(response, status=200):
+    response.get_data()  # Drain streamed responses too, so their whole body is timed
+    if response.status_code != status:
+        raise RuntimeError(f'{response.request.path} returned {response.status_code}: {response.data[:200]!r}')
+    return response
+
+def http_heat(heat_id, surfer_count=5, wave_cap=20, waves_per_surfer=20):
+    """Create (or recreate) a heat over HTTP and score it"""
+    query = f'?heat_id={heat_id}'
+    if client.post('/heats', json={'heat_id': heat_id, 'surfer_count': surfer_count,
+                                   'wave_cap': wave_cap}).status_code == 409:
+        ok(client.post('/reset_heat' + query))
+    ok(client.post('/batch' + query, json={'operations': score_ops(surfer_count, wave_cap, waves_per_surfer)}))
+    ok(client.post('/update_surfers' + query, json={
+        color.lower(): {'name': f'{color} {heat_id}', 'goal': 12}
+        for color in sjp.JERSEY_COLORS[:surfer_count]
+    }))
+    return query
+
+@benchmark('http.update_score')
+def _():
+    query = http_heat('bench-score', waves_per_surfer=6)
+    def step():
+        ok(client.post('/update_score' + query, json={
+            'surfer_idx': rng.randrange(5), 'wave_idx': rng.randrange(20), 'score': random_score()}))
+    return step
+
+@benchmark('http.batch_10_ops', rounds=1000)
+def _():
+    query = http_heat('bench-batch', waves_per_surfer=6)
+    def step():
+        ok(client.post('/batch' + query, json={'operations': [
+            {'op': 'set_score', 'surfer_idx': rng.randrange(5), 'wave_idx': rng.randrange(20),
+             'score': random_score()} for _ in range(10)]}))
+    return step
+
+@benchmark('http.toggle_priority')
+def _():
+    query = http_heat('bench-priority', waves_per_surfer=2)
+    return lambda: ok(client.post('/toggle_priority' + query, json={'surfer_idx': rng.randrange(5)}))
+
+@benchmark('http.get_rankings_after_edit')
+def _():
+    query = http_heat('bench-rankings')
+    def step():
+        sjp.apply_operations('bench-rankings', [{'op': 'set_score', 'surfer_idx': rng.randrange(5),
+                                                 'wave_idx': rng.randrange(20), 'score': random_score()}])
+        ok(client.get('/get_rankings' + query))
+    return step
+
+@benchmark('http.get_rankings_cached')
+def _():
+    query = http_heat('bench-rankings-cached')
+    return lambda: ok(client.get('/get_rankings' + query))
+
+@benchmark('http.get_rankings_304')
+def _():
+    query = http_heat('bench-rankings-304')
+    etag = ok(client.get('/get_rankings' + query)).headers['ETag']
+    return lambda: ok(client.get('/get_rankings' + query, headers={'If-None-Match': etag}), 304)
+
+@benchmark('http.get_rankings_delta_after_edit')
+def _():
+    # A scoreboard that asks for what changed since the version it has, in the binary encoding
+    query = http_heat('bench-rankings-delta')
+    def step():
+        since = sjp.get_heat('bench-rankings-delta').snapshot.version
+        sjp.apply_operations('bench-rankings-delta', [{'op': 'set_score', 'surfer_idx': rng.randrange(5),
+                                                       'wave_idx': rng.randrange(20), 'score': random_score()}])
+        ok(client.get(f'/get_rankings{query}&since={since}&fields=total,position&format=binary'))
+    return step
+
+@benchmark('http.get_rankings_at_scrub')
+def _():
+    # Post-heat review scrubbing back and forth through a 20 minute heat
+    query = http_heat('bench-scrub', waves_per_surfer=12)
+    return lambda: ok(client.get(f'/get_rankings_at{query}&t={rng.uniform(0, 1200):.1f}'))
+
+@benchmark('http.get_timeline_after_edit', rounds=1000)
+def _():
+    query = http_heat('bench-timeline', waves_per_surfer=12)
+    def step():
+        sjp.apply_operations('bench-timeline', [{'op': 'set_score', 'surfer_idx': rng.randrange(5),
+                                                 'wave_idx': rng.randrange(20), 'score': random_score()}])
+        ok(client.get('/get_timeline' + query))
+    return step
+
+@benchmark('http.get_forecast_after_edit', rounds=20)
+def _():
+    # Halfway through the heat: every score edit means a fresh 20000-ending forecast
+    query = http_heat('bench-forecast', waves_per_surfer=4)
+    ok(client.post('/update_metadata' + query, json={
+        'start_time': (datetime.now() - timedelta(minutes=10)).isoformat()}))
+    def step():
+        sjp.apply_operations('bench-forecast', [{'op': 'set_score', 'surfer_idx': rng.randrange(5),
+                                                 'wave_idx': rng.randrange(4), 'score': random_score()}])
+        ok(client.get('/get_forecast' + query))
+    return step
+
+@benchmark('http.get_priority_order')
+def _():
+    query = http_heat('bench-priority-read', waves_per_surfer=2)
+    return lambda: ok(client.get('/get_priority_order' + query))
+
+@benchmark('http.get_rankings_100_heats', rounds=1000)
+def _():
+    # More heats than stay resident, so some reads reload an evicted heat
+    queries = [http_heat(f'bench-many-{n:03d}', waves_per_surfer=rng.randint(2, 10)) for n in range(100)]
+    return lambda: ok(client.get('/get_rankings' + rng.choice(queries)))
+
+@benchmark('http.rescore_100_closed_heats', rounds=10)
+def _():
+    # A rule change re-scores the whole event, athlete results included
+    heat_ids = []
+    for n in range(100):
+        heat_ids.append(f'bench-rescore-{n:03d}')
+        ok(client.post('/close_heat' + http_heat(heat_ids[-1], waves_per_surfer=rng.randint(2, 10))))
+    rules = [{'best_waves': 2}, {'best_waves': 3, 'tiebreak': 'best_wave'}]
+    return lambda: ok(client.post('/rescore', json={'heat_ids': heat_ids, 'scoring': rng.choice(rules)}))
+
+@benchmark('http.close_and_advance_bracket_heat', rounds=500)
+def _():
+    # 256-surfer man-on-man event: close a first-round heat, seed its winner into round two
+    if client.get('/events/bench-event').status_code == 404:
+        ok(client.post('/events', json={'event_id': 'bench-event', 'surfers_per_heat': 2,
+                                        'surfers': [f'Surfer {n:03d}' for n in range(256)]}), 201)
+    def step():
+        query = f'?heat_id=bench-event-r1-h{rng.randint(1, 128)}'
+        ok(client.post('/update_score' + query, json={'surfer_idx': rng.randrange(2), 'wave_idx': 0,
+                                                      'score': random_score()}))
+        ok(client.post('/close_heat' + query))
+    return step
+
+@benchmark('http.get_event_view_256_after_edit', rounds=200)
+def _():
+    if client.get('/events/bench-event').status_code == 404:
+        ok(client.post('/events', json={'event_id': 'bench-event', 'surfers_per_heat': 2,
+                                        'surfers': [f'Surfer {n:03d}' for n in range(256)]}), 201)
+    def step():
+        sjp.apply_operations(f'bench-event-r1-h{rng.randint(1, 128)}', [{
+            'op': 'set_score', 'surfer_idx': rng.randrange(2), 'wave_idx': 1, 'score': random_score()}])
+        ok(client.get('/events/bench-event'))
+    return step
+
+@benchmark('http.export_csv_full', rounds=500)
+def _():
+    query = http_heat('bench-csv', surfer_count=6)
+    return lambda: ok(client.get('/export_csv' + query))
+
+@benchmark('http.export_pdf_cached', rounds=500)
+def _():
+    query = http_heat('bench-pdf', surfer_count=6)
+    return lambda: ok(client.get('/export_pdf' + query))
+
+@benchmark('http.export_pdf_render', rounds=30)
+def _():
+    # Every download follows a score change, so each one waits for a fresh render
+    query = http_heat('bench-pdf-render', surfer_count=6)
+    def step():
+        sjp.apply_operations('bench-pdf-render', [{'op': 'set_score', 'surfer_idx': rng.randrange(6),
+                                                   'wave_idx': rng.randrange(20), 'score': random_score()}])
+        ok(client.get('/export_pdf' + query))
+    return step
+
+@benchmark('http.get_session_tracker_500', rounds=500)
+def _():
+    install_tracker()
+    return lambda: ok(client.get('/get_session_tracker'))
+
+@benchmark('http.athletes_page_500', rounds=1000)
+def _():
+    install_tracker()
+    return lambda: ok(client.get('/athletes?sort=best&order=desc&q=01&offset=20&limit=25'))
+
+@benchmark('http.export_session_csv_500', rounds=100)
+def _():
+    install_tracker()
+    return lambda: ok(client.get('/export_session_csv'))
+
+@benchmark('http.metrics_scrape', rounds=500)
+def _():
+    return lambda: ok(client.get('/metrics'))
+
+# ---------------------------------------------------------------------------
+# Cold start (a fresh interpreter per sample)
+# ---------------------------------------------------------------------------
+
+@benchmark('startup.boot_and_first_page', rounds=5)
+def _():
+    # Import the app and serve "/" once, as a new gunicorn worker would
+    command = [sys.executable, '-c', "import surf_judge_pro as s; s.app.test_client().get('/').get_data()"]
+    here = os.path.dirname(os.path.abspath(__file__))
+    return lambda: subprocess.run(command, check=True, cwd=here)
+
+# ---------------------------------------------------------------------------
+# Reporting and baselines
+# ---------------------------------------------------------------------------
+
+def machine():
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(), 'cpus': os.cpu_count()}
+
+def print_report(results, baseline):
+    header = f"{'benchmark':34} {'rounds':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'ops/s':>10} {'vs base':>8}"
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        base = baseline.get(name)
+        change = f"{(r['p50_ms'] / base['p50_ms'] - 1) * 100:+7.1f}%" if base and base['p50_ms'] else '     new'
+        print(f"{name:34} {r['rounds']:6d} {r['p50_ms']:9.3f} {r['p90_ms']:9.3f} {r['p99_ms']:9.3f} "
+              f"{r['max_ms']:9.3f} {r['ops_per_s']:10.0f} {change:>8}")
+
+def regressions(results, baseline, threshold, min_delta):
+    """Benchmarks whose p50 exceeds the baseline by more than threshold (and min_delta ms)"""
+    failed = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        limit = max(base['p50_ms'] * (1 + threshold), base['p50_ms'] + min_delta)
+        if r['p50_ms'] > limit:
+            failed.append((name, base['p50_ms'], r['p50_ms']))
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ranking, priority and export hot paths')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--rounds', type=float, default=1.0, help='scale every benchmark\'s rounds')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark; the fastest is kept')
+    parser.add_argument('--check', action='store_true', help='exit 1 on a regression against the baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file (default: %(default)s)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed p50 slowdown as a fraction (default: %(default)s)')
+    parser.add_argument('--min-delta', type=float, default=DEFAULT_MIN_DELTA_MS,
+                        help='ignore slowdowns smaller than this many ms (default: %(default)s)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+    baseline = stored.get('results', {})
+    if baseline and stored.get('machine') != machine():
+        print(f"note: baseline was recorded on {stored.get('machine')}", file=sys.stderr)
+
+    results = {}
+    for name, make in benchmarks:
+        if args.filter in name:
+            fn, rounds = make()
+            rounds = max(1, int(rounds * args.rounds))
+            # Best of several runs: the least disturbed one is the most repeatable
+            results[name] = min((run(fn, rounds) for _ in range(args.repeat)), key=lambda r: r['p50_ms'])
+
+    print_report(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'machine': machine(), 'results': results}, f, indent=2)
+
+    if args.save_baseline:
+        merged = dict(baseline, **results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'machine': machine(), 'results': merged}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'baseline saved to {args.baseline}')
+
+    if args.check:
+        failed = regressions(results, baseline, args.threshold, args.min_delta)
+        for name, before, after in failed:
+            print(f'REGRESSION {name}: p50 {before:.3f} ms -> {after:.3f} ms', file=sys.stderr)
+        if failed:
+            return 1
+        print(f'no regressions over {args.threshold:.0%} against the baseline')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Win and advance chances for a live heat, by Monte Carlo simulation.
+
+Kept apart from the web app (like pdf_export) so the simulation processes load
+only this and the scoring rules. Everything here works on plain data that can be
+pickled to a worker process.
+
+Each simulation plays out the rest of the heat: every surfer catches a Poisson
+number of further waves (their usual wave rate times the time left) scored by
+drawing from their wave history (blended with a prior), and the heat is then ranked with the heat's own
+scoring rule, interference and tiebreaks included.
+"""
+
+import bisect
+import math
+import random
+
+from scoring import compile_scoring
+
+def wave_count_table(expected, most):
+    """Cumulative Poisson(expected) probabilities of 0..most-1 more waves: bisecting
+    a uniform draw into it gives a wave count, capped at most"""
+    table = []
+    p = cumulative = math.exp(-expected)
+    for count in range(most):
+        table.append(cumulative)
+        p *= expected / (count + 1)
+        cumulative += p
+    return table
+
+def simulate_heat(heat, simulations, seed):
+    """Play out the rest of the heat simulations times.
+    
+    heat is {'rule': scoring spec, 'advancing', 'wave_cap', 'surfers': [{'waves'
+    (scored so far), 'interference', 'expected_waves' (more to come, on average),
+    'pool' (scores to draw from), 'weights' (optional, relative weight of each
+    pool score)}, ...]}. Returns [wins, advances] per surfer.
+    """
+    rng = random.Random(seed)
+    rule = compile_scoring(**heat['rule'])
+    wave_cap = heat['wave_cap']
+    advancing = heat['advancing']
+    surfers = heat['surfers']
+    
+    # Draw every simulation's wave counts and scores up front, a surfer at a time
+    plays = []
+    for surfer in surfers:
+        room = wave_cap - len(surfer['waves'])
+        if room <= 0 or surfer['expected_waves'] <= 0 or not surfer['pool']:
+            plays.append(None)
+            continue
+        table = wave_count_table(surfer['expected_waves'], room)
+        counts = [bisect.bisect_right(table, rng.random()) for _ in range(simulations)]
+        plays.append((counts, rng.choices(surfer['pool'], surfer.get('weights'), k=sum(counts))))
+    
+    # A surfer who catches nothing more keeps the key they have now
+    current = [sorted(surfer['waves'], reverse=True) for surfer in surfers]
+    standing = [rule.key(rule.total(waves[:rule.best_waves], surfer['interference']), waves, wave_cap, idx)
+                for idx, (surfer, waves) in enumerate(zip(surfers, current))]
+    tally = [[0, 0] for _ in surfers]
+    order = range(len(surfers))
+    if not any(plays):
+        # Nothing left to happen (heat over): every simulation ends the same way
+        ranked = sorted(order, key=standing.__getitem__, reverse=True)
+        tally[ranked[0]][0] = simulations
+        for idx in ranked[:advancing]:
+            tally[idx][1] = simulations
+        return tally
+    
+    used = [0] * len(surfers)
+    for simulation in range(simulations):
+        keys = list(standing)
+        for idx, play in enumerate(plays):
+            if play is None:
+                continue
+            count = play[0][simulation]
+            if count:
+                start = used[idx]
+                used[idx] = start + count
+                waves = sorted(current[idx] + play[1][start:start + count], reverse=True)
+                total = rule.total(waves[:rule.best_waves], surfers[idx]['interference'])
+                keys[idx] = rule.key(total, waves, wave_cap, idx)
+        ranked = sorted(order, key=keys.__getitem__, reverse=True)
+        tally[ranked[0]][0] += 1
+        for idx in ranked[:advancing]:
+            tally[idx][1] += 1
+    return tally
@@ -0,0 +1,140 @@
+"""
+PDF heat sheets for Surf Judge Pro.
+
+Kept apart from the web app so the PDF render processes load reportlab and
+nothing else. Everything here works on plain data (a heat's to_dict() and its
+rankings) that can be pickled to a worker process.
+"""
+
+import io
+
+def render_heat_pdf(heat, results):
+    """Render the heat results sheet and return the PDF bytes"""
+    # Imported here so only the processes that render PDFs load reportlab
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    
+    # Create PDF in memory
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    elements = []
+    
+    styles = getSampleStyleSheet()
+    
+    # Title
+    title = Paragraph(f"<b>KSS - Heat Results</b>", styles['Title'])
+    elements.append(title)
+    elements.append(Spacer(1, 6))
+    
+    subtitle = Paragraph(f"<i>Karibe Surf Score Judging System</i>", styles['Normal'])
+    elements.append(subtitle)
+    elements.append(Spacer(1, 12))
+    
+    round_title = Paragraph(f"<b>{heat['metadata']['round']}</b>", styles['Heading2'])
+    elements.append(round_title)
+    elements.append(Spacer(1, 12))
+    
+    # Metadata
+    meta_text = f"Heat: {heat['metadata']['heat_number']} | Category: {heat['metadata']['category']} | Round: {heat['metadata']['round']}"
+    meta = Paragraph(meta_text, styles['Normal'])
+    elements.append(meta)
+    
+    location_text = f"Location: {heat['metadata']['location']} | Duration: {heat['metadata']['duration']} min"
+    location = Paragraph(location_text, styles['Normal'])
+    elements.append(location)
+    elements.append(Spacer(1, 12))
+    
+    # Notes if present
+    if heat['metadata']['notes']:
+        notes_text = f"<b>Notes:</b> {heat['metadata']['notes']}"
+        notes = Paragraph(notes_text, styles['Normal'])
+        elements.append(notes)
+        elements.append(Spacer(1, 20))
+    else:
+        elements.append(Spacer(1, 8))
+    
+    # Full scoring grid (limited to waves that were actually used)
+    grid_title = Paragraph("<b>Full Scoring Grid</b>", styles['Heading2'])
+    elements.append(grid_title)
+    elements.append(Spacer(1, 8))
+    
+    # Determine max wave used
+    max_wave_idx = 0
+    for surfer in heat['surfers']:
+        for idx, wave in enumerate(surfer['waves']):
+            if wave is not None:
+                max_wave_idx = max(max_wave_idx, idx)
+    
+    # Show up to max_wave_idx + 1, minimum 12
+    num_waves = max(12, max_wave_idx + 1)
+    
+    grid_data = [['Surfer'] + [f'W{i+1}' for i in range(num_waves)]]
+    for surfer in heat['surfers']:
+        row = [surfer['color']]
+        for i in range(num_waves):
+            wave = surfer['waves'][i] if i < len(surfer['waves']) else None
+            row.append(f"{wave:.1f}" if wave is not None else '-')
+        grid_data.append(row)
+    
+    grid_table = Table(grid_data)
+    grid_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    elements.append(grid_table)
+    elements.append(Spacer(1, 20))
+    
+    # Final results section
+    results_title = Paragraph("<b>Final Results</b>", styles['Heading2'])
+    elements.append(results_title)
+    elements.append(Spacer(1, 8))
+    
+    # Results table
+    data = [['Position', 'Surfer', 'Best Wave', '2nd Wave', 'Total', 'Interference']]
+    
+    interference_labels = {
+        0: 'None',
+        1: 'INT-1',
+        2: 'INT-2',
+        3: 'INT-3',
+        4: '2x INT',
+        5: '2x INT',
+        6: 'DQ'
+    }
+    
+    for result in results:
+        waves = result['top_waves'] + [None] * (2 - len(result['top_waves']))
+        interference_label = interference_labels.get(result['interference'], 'None')
+        data.append([
+            str(result['position']),
+            result['color'],
+            f"{waves[0]:.2f}" if waves[0] is not None else '-',
+            f"{waves[1]:.2f}" if waves[1] is not None else '-',
+            f"{result['total']:.2f}",
+            interference_label
+        ])
+    
+    table = Table(data)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    
+    elements.append(table)
+    doc.build(elements)
+    
+    return buffer.getvalue()
@@ -0,0 +1,86 @@
+"""
+Scoring rules for Surf Judge Pro: which waves count, interference penalties and
+tiebreaks.
+
+Kept apart from the web app so the forecast simulation processes rank heats with
+exactly the same rules without loading the app.
+"""
+
+import functools
+
+# Interference schemes: per code 0-6, the multiplier for each counting wave,
+# best first (waves past the tuple count in full); None = disqualified (total 0)
+INTERFERENCE_SCHEMES = {
+    # ISA Official Rules
+    'isa': {
+        0: (),        # None
+        1: (1, 0.5),  # INT-1: Halve 2nd highest (non-priority)
+        2: (1, 0),    # INT-2: Zero 2nd highest (priority)
+        3: (0,),      # INT-3: Zero highest (last 5min WSG/Olympic)
+        4: (0.5, 0),  # 2x INT (non-priority + priority): Halve highest, Zero 2nd
+        5: (0, 0),    # 2x INT (both priority or one in last 5min): Zero both
+        6: None,      # DQ: Disqualified
+    },
+    # Interference is recorded but not penalized (training heats); DQ still stands
+    'none': {6: None},
+}
+TIEBREAKS = ('countback', 'best_wave', 'none')
+
+class ScoringRule:
+    """How a heat is scored: the best_waves that count, an interference scheme and a tiebreak.
+    
+    Rules are compiled once (see compile_scoring) into per-code penalty factors and
+    a key function, and shared by every engine that uses them. Tiebreaks:
+    countback compares the best wave, then the next best and so on; best_wave
+    compares only the best wave; none compares nothing. Any tie left goes to the
+    lower jersey index, as before.
+    """
+    
+    __slots__ = ('best_waves', 'interference', 'tiebreak', 'key', '_factors')
+    
+    def __init__(self, best_waves=2, interference='isa', tiebreak='countback'):
+        self.best_waves = best_waves
+        self.interference = interference
+        self.tiebreak = tiebreak
+        scheme = INTERFERENCE_SCHEMES[interference]
+        self._factors = tuple(scheme.get(code, ()) for code in range(7))
+        self.key = getattr(self, '_key_' + tiebreak)
+    
+    def spec(self):
+        return {'best_waves': self.best_waves, 'interference': self.interference, 'tiebreak': self.tiebreak}
+    
+    def total(self, counting, interference):
+        """Heat total for the counting waves (best first) after interference penalties"""
+        factors = self._factors[interference]
+        if factors is None:
+            return 0
+        total = sum(counting)
+        for score, factor in zip(counting, factors):
+            if factor != 1:
+                total -= score * (1 - factor)
+        # Ensure total doesn't go negative
+        return max(0, total)
+    
+    # Leaderboard keys (ascending, so the leader sorts last) from the total, every
+    # valid wave best first, the surfer's wave slot count and index
+    @staticmethod
+    def _key_countback(total, valid_waves, wave_cap, idx):
+        # 1. By total
+        # 2. If tied on total, by highest single wave
+        # 3. If still tied, by 2nd wave, 3rd wave, etc. (padded with 0s)
+        # 4. Still tied: lower surfer index first, as the stable sort always did
+        return (total,) + tuple(valid_waves) + (0,) * (wave_cap - len(valid_waves)) + (-idx,)
+    
+    @staticmethod
+    def _key_best_wave(total, valid_waves, wave_cap, idx):
+        return (total, valid_waves[0] if valid_waves else 0, -idx)
+    
+    @staticmethod
+    def _key_none(total, valid_waves, wave_cap, idx):
+        return (total, -idx)
+
+@functools.lru_cache(maxsize=64)
+def compile_scoring(best_waves=2, interference='isa', tiebreak='countback'):
+    return ScoringRule(best_waves, interference, tiebreak)
+
+DEFAULT_SCORING = compile_scoring()
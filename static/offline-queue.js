@@ -0,0 +1,176 @@
+// Offline mutation queue, shared by the judging page and the service worker.
+//
+// Every scoring change (scores, interference, wave marks, priority) is written to
+// IndexedDB first and only then sent to /batch, so nothing entered on a patchy
+// beach connection is lost. Changes to the same thing coalesce while queued
+// (the last score typed into a cell wins), and entries are deleted only once the
+// server has acknowledged them with the heat version that includes them.
+//
+// The page and the service worker each load this file, so flushes are also
+// serialized across them with a Web Lock: otherwise one could resend an entry
+// the other is already sending, late, over a newer value typed in between.
+//
+// All queued operations are safe to send twice: scores, interference levels and
+// wave marks are absolute values, and replaying a run of "send to back" priority
+// moves gives the same order as applying it once.
+const KSSQueue = (() => {
+    const DB_NAME = 'kss-offline';
+    const MAX_BATCH = 200;  // Operations per /batch request
+    const FLUSH_LOCK = 'kss-flush';
+
+    let dbPromise = null;
+    let flushing = null;
+    let rerun = null;
+
+    function openDb() {
+        if (!dbPromise) {
+            dbPromise = new Promise((resolve, reject) => {
+                const request = indexedDB.open(DB_NAME, 1);
+                request.onupgradeneeded = () => {
+                    const db = request.result;
+                    db.createObjectStore('ops', { keyPath: 'id', autoIncrement: true })
+                        .createIndex('heat_key', ['heat_id', 'key']);
+                    db.createObjectStore('acks', { keyPath: 'heat_id' });
+                    db.createObjectStore('rejected', { keyPath: 'id', autoIncrement: true });
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => reject(request.error);
+            });
+        }
+        return dbPromise;
+    }
+
+    // Run fn(stores) in one transaction; resolves with fn's result once committed
+    function transaction(names, mode, fn) {
+        return openDb().then(db => new Promise((resolve, reject) => {
+            const tx = db.transaction(names, mode);
+            const stores = {};
+            names.forEach(name => { stores[name] = tx.objectStore(name); });
+            const result = fn(stores);
+            tx.oncomplete = () => resolve(result.value);
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        }));
+    }
+
+    // What an operation overwrites: a newer operation with the same key replaces it
+    function keyOf(op) {
+        switch (op.op) {
+            case 'set_score': return `score:${op.surfer_idx}:${op.wave_idx}`;
+            case 'set_judge_score': return `judge:${op.surfer_idx}:${op.wave_idx}:${op.judge}`;
+            case 'set_interference': return `interference:${op.surfer_idx}`;
+            case 'mark_interference_wave': return `mark:${op.surfer_idx}:${op.wave_idx}`;
+            case 'toggle_priority': return `priority:${op.surfer_idx}`;
+        }
+        throw new Error(`Operation ${op.op} cannot be queued`);
+    }
+
+    function enqueue(heatId, op) {
+        const key = keyOf(op);
+        return transaction(['ops'], 'readwrite', ({ ops }) => {
+            // Coalesce: drop the older queued change to the same thing
+            ops.index('heat_key').openCursor(IDBKeyRange.only([heatId, key])).onsuccess = event => {
+                const cursor = event.target.result;
+                if (cursor) {
+                    cursor.delete();
+                    cursor.continue();
+                }
+            };
+            ops.add({ heat_id: heatId, key: key, op: op, queued_at: Date.now() });
+            return {};
+        });
+    }
+
+    // Queued entries in the order they were entered, optionally for one heat
+    function pending(heatId) {
+        return transaction(['ops'], 'readonly', ({ ops }) => {
+            const result = { value: [] };
+            ops.getAll().onsuccess = event => {
+                result.value = event.target.result.filter(entry => heatId === undefined || entry.heat_id === heatId);
+            };
+            return result;
+        });
+    }
+
+    function acknowledge(ids, store, record) {
+        return transaction(['ops', store], 'readwrite', stores => {
+            ids.forEach(id => stores.ops.delete(id));
+            stores[store].put(record);
+            return {};
+        });
+    }
+
+    // Send one heat's entries; resolves with the results (normally one)
+    function sendBatch(heatId, entries) {
+        return fetch('/batch?heat_id=' + encodeURIComponent(heatId), {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            // age_ms lets the server stamp each change with when it was entered, not sent
+            body: JSON.stringify({ operations: entries.map(entry =>
+                Object.assign({}, entry.op, { age_ms: Date.now() - entry.queued_at })) })
+        }).then(response => response.json().catch(() => ({})).then(data => {
+            if (response.ok) {
+                return acknowledge(entries.map(entry => entry.id), 'acks',
+                                   { heat_id: heatId, version: data.version, acked_at: Date.now() })
+                    .then(() => [{ heat_id: heatId, version: data.version,
+                                   rankings: data.rankings, priority_order: data.priority_order }]);
+            }
+            if (response.status === 400 || response.status === 404) {
+                // The server will never take it (bad value, heat gone): set the
+                // operation aside for the record and send the rest without it
+                const bad = response.status === 400 && entries[data.index] ? [entries[data.index]] : entries;
+                const error = data.error || `HTTP ${response.status}`;
+                const rest = entries.filter(entry => !bad.includes(entry));
+                return acknowledge(bad.map(entry => entry.id), 'rejected', {
+                    heat_id: heatId, error: error, operations: bad.map(entry => entry.op), rejected_at: Date.now()
+                }).then(() => {
+                    const results = bad.map(entry => ({ heat_id: heatId, error: error, rejected: entry.op }));
+                    return rest.length ? sendBatch(heatId, rest).then(more => results.concat(more)) : results;
+                });
+            }
+            throw new Error(`Sync failed: HTTP ${response.status}`);
+        }));
+    }
+
+    // Run fn while holding the flush lock shared by every page and the service
+    // worker (browsers without Web Locks only serialize within this context)
+    function withFlushLock(fn) {
+        const locks = typeof navigator !== 'undefined' && navigator.locks;
+        return locks ? locks.request(FLUSH_LOCK, fn) : fn();
+    }
+
+    // Send everything queued, heat by heat, oldest first. Resolves with one result
+    // per batch sent or operation refused; rejects (keeping the rest queued) when
+    // the network fails.
+    function flush() {
+        if (flushing) {
+            // More may have been queued since the running flush read the queue
+            rerun = rerun || flushing.catch(() => {}).then(() => {
+                rerun = null;
+                return flush();
+            });
+            return rerun;
+        }
+        // The queue is read only once the lock is held, so whatever another
+        // context sent in the meantime has been acknowledged and is gone
+        flushing = withFlushLock(() => pending().then(entries => {
+            const heats = new Map();
+            entries.forEach(entry => {
+                if (!heats.has(entry.heat_id)) heats.set(entry.heat_id, []);
+                heats.get(entry.heat_id).push(entry);
+            });
+            const results = [];
+            let chain = Promise.resolve();
+            heats.forEach((heatEntries, heatId) => {
+                for (let start = 0; start < heatEntries.length; start += MAX_BATCH) {
+                    const batch = heatEntries.slice(start, start + MAX_BATCH);
+                    chain = chain.then(() => sendBatch(heatId, batch)).then(sent => results.push(...sent));
+                }
+            });
+            return chain.then(() => results);
+        })).finally(() => { flushing = null; });
+        return flushing;
+    }
+
+    return { enqueue, pending, flush };
+})();
@@ -1,19 +1,26 @@
-const CACHE_NAME = 'kss-coach-v1';
-const urlsToCache = [
-  '/',
-  '/static/manifest.json',
-  '/static/kss.png',
-  '/static/kss_512.png'
-];
-
-// Install event - cache core assets
+// Served from /service-worker.js so it controls the whole app, not just /static/
+importScripts('/static/offline-queue.js');
+
+const CACHE_NAME = 'kss-coach-v2';
+const SHELL_TIMEOUT_MS = 3000;  // Then serve the cached page instead of waiting on the network
+const SYNC_TAG = 'kss-flush';
+
+// The page plus every versioned asset it links to (/static/...?v=<hash>)
+function cacheShell(cache, url) {
+  return fetch(url).then(response => {
+    if (!response.ok) return;
+    return response.clone().text().then(html => {
+      const assets = [...new Set(html.match(/\/static\/[^"'\s]+\?v=[0-9a-f]+/g) || [])];
+      return Promise.all([cache.put(url, response), cache.addAll(assets)]);
+    });
+  });
+}
+
+// Install event - cache the app shell
 self.addEventListener('install', event => {
   event.waitUntil(
     caches.open(CACHE_NAME)
-      .then(cache => {
-        console.log('Caching app shell');
-        return cache.addAll(urlsToCache);
-      })
+      .then(cache => cacheShell(cache, '/'))
       .then(() => self.skipWaiting())
   );
 });
@@ -34,21 +41,69 @@ self.addEventListener('activate', event => {
   );
 });
 
-// Fetch event - network first, fall back to cache
-self.addEventListener('fetch', event => {
-  event.respondWith(
-    fetch(event.request)
-      .then(response => {
-        // Clone response to cache it
-        const responseToCache = response.clone();
-        caches.open(CACHE_NAME).then(cache => {
-          cache.put(event.request, responseToCache);
-        });
-        return response;
-      })
-      .catch(() => {
-        // Network failed, try cache
-        return caches.match(event.request);
-      })
+// Versioned assets never change: serve them from the cache, fetching (and
+// dropping older versions of the same file) only on a miss
+function cacheFirst(request) {
+  return caches.open(CACHE_NAME).then(cache =>
+    cache.match(request).then(cached => cached || fetch(request).then(response => {
+      if (response.ok) {
+        const copy = response.clone();
+        const path = new URL(request.url).pathname;
+        cache.keys()
+          .then(keys => Promise.all(keys
+            .filter(key => new URL(key.url).pathname === path)
+            .map(key => cache.delete(key))))
+          .then(() => cache.put(request, copy));
+      }
+      return response;
+    }))
   );
+}
+
+// The page carries the heat's current scores, so it comes from the network when
+// the network answers in time; the cached copy keeps the app opening offline
+function networkFirst(request, timeout) {
+  return caches.open(CACHE_NAME).then(cache => {
+    const network = fetch(request).then(response => {
+      if (response.ok) cache.put(request, response.clone());
+      return response;
+    });
+    const fromCache = () => cache.match(request).then(cached => cached || network);
+    const slow = timeout && new Promise(resolve => setTimeout(resolve, timeout)).then(fromCache);
+    return (slow ? Promise.race([network, slow]) : network)
+      .catch(fromCache)
+      .catch(() => new Response('Offline, and this page has not been opened on this device yet.',
+                                { status: 503, headers: { 'Content-Type': 'text/plain' } }));
+  });
+}
+
+// Fetch event - scoring writes go through the page's offline queue, never the cache
+self.addEventListener('fetch', event => {
+  const url = new URL(event.request.url);
+  if (event.request.method !== 'GET' || url.origin !== self.location.origin) {
+    return;
+  }
+  if (url.pathname.startsWith('/static/')) {
+    event.respondWith(url.searchParams.has('v') ? cacheFirst(event.request) : networkFirst(event.request));
+  } else if (event.request.mode === 'navigate') {
+    event.respondWith(networkFirst(event.request, SHELL_TIMEOUT_MS));
+  } else if (url.pathname.startsWith('/get_')) {
+    // Last known rankings and priority for offline reloads
+    event.respondWith(networkFirst(event.request));
+  }
+  // Everything else (the live stream, exports, PDF jobs) goes straight to the network
+});
+
+// Tell open pages what the server acknowledged, so they show its rankings
+function notifyClients(results) {
+  return self.clients.matchAll({ type: 'window' }).then(clients =>
+    clients.forEach(client => client.postMessage({ type: 'kss-synced', results: results })));
+}
+
+// Background sync - flush the queue once connectivity returns, even if the page
+// was closed; a rejected promise makes the browser retry later
+self.addEventListener('sync', event => {
+  if (event.tag === SYNC_TAG) {
+    event.waitUntil(KSSQueue.flush().then(notifyClients));
+  }
 });
@@ -1,354 +1,3052 @@
-from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
+import time
+STARTED = time.perf_counter()  # Taken first, so the startup report covers every import
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory, Response, g, url_for
+from jinja2 import FileSystemBytecodeCache
 import json
-from datetime import datetime
+import math
+from array import array
+import bisect
+import os
+import sys
+import sqlite3
+import struct
+import threading
+import uuid
+import hashlib
+from collections import deque, Counter, OrderedDict
+from contextlib import contextmanager
+import atexit
+from datetime import datetime, timedelta
 import io
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
 import csv
+import zipfile
+from pdf_export import render_heat_pdf  # reportlab itself loads on the first render
+from scoring import INTERFERENCE_SCHEMES, TIEBREAKS, compile_scoring, DEFAULT_SCORING
+from forecast import simulate_heat
+
+# Startup report: (phase, seconds) in the order the phases ran
+startup_phases = []
+_phase_started = STARTED
+
+def startup_phase(name):
+    """Record the time since the previous phase (or the first import) as name"""
+    global _phase_started
+    now = time.perf_counter()
+    startup_phases.append((name, now - _phase_started))
+    _phase_started = now
+
+startup_phase('imports')
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 
-# Store heat data in memory
-current_heat = {
-    'metadata': {
-        'heat_number': '',
-        'category': '',
-        'round': '',
-        'location': '',
-        'duration': 20,  # minutes
-        'start_time': None,
-        'is_closed': False,
-        'notes': ''
-    },
-    'surfers': [
-        {'color': 'Red', 'name': '', 'goal': 0, 'waves': [None] * 20, 'interference': 0, 'interference_waves': []},
-        {'color': 'Yellow', 'name': '', 'goal': 0, 'waves': [None] * 20, 'interference': 0, 'interference_waves': []},
-        {'color': 'Black', 'name': '', 'goal': 0, 'waves': [None] * 20, 'interference': 0, 'interference_waves': []},
-        {'color': 'White', 'name': '', 'goal': 0, 'waves': [None] * 20, 'interference': 0, 'interference_waves': []},
-        {'color': 'Blue', 'name': '', 'goal': 0, 'waves': [None] * 20, 'interference': 0, 'interference_waves': []}
-    ],
-    'priority_order': []  # Empty = no priority established yet
-}
-
-# Session tracker for coaching (persists across heats)
-session_tracker = {}  # {name: [heat1_score, heat2_score, ...], goal: X}
-
-def calculate_rankings():
-    """Calculate live rankings for all surfers with proper tiebreaker logic"""
-    results = []
+# Compiled templates are cached on disk, so only the first boot after a template
+# changes pays for compiling index.html (build steps can pre-fill the cache by
+# importing the app once)
+TEMPLATE_CACHE = os.environ.get('SURF_JUDGE_TEMPLATE_CACHE', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '__pycache__', 'templates'))
+try:
+    os.makedirs(TEMPLATE_CACHE, exist_ok=True)
+    if os.access(TEMPLATE_CACHE, os.W_OK):
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE)
+except OSError:
+    pass  # Read-only install: compile in memory as before
+
+# Jersey colors in ISA order; a heat uses the first surfer_count of them
+JERSEY_COLORS = ['Red', 'Yellow', 'Black', 'White', 'Blue', 'Green']
+MIN_SURFERS, MAX_SURFERS = 2, len(JERSEY_COLORS)
+MAX_WAVE_CAP = 40
+EMPTY_WAVE = math.nan  # Unscored wave slot
+MAX_JUDGES = 5  # Judges on a scoring panel
+AGGREGATIONS = ('drop_high_low', 'mean', 'median')
+
+class Surfer:
+    """One jersey in a heat. Waves are a fixed-size array of doubles, NaN = no score.
+    
+    With a judging panel, panel holds every judge's score too: MAX_JUDGES slots per
+    wave, wave-major, NaN = not entered. It stays None until a judge scores.
+    """
+    
+    __slots__ = ('color', 'name', 'goal', 'waves', 'interference', 'interference_waves', 'panel')
+    
+    def __init__(self, color, wave_cap=20):
+        self.color = color
+        self.name = ''
+        self.goal = 0
+        self.waves = array('d', [EMPTY_WAVE]) * wave_cap
+        self.interference = 0
+        self.interference_waves = []
+        self.panel = None
+    
+    def wave(self, wave_idx):
+        """Score of one wave slot, or None if it has not been scored"""
+        score = self.waves[wave_idx]
+        return None if score != score else score
+    
+    def valid_waves(self):
+        """Scored waves in slot order"""
+        return [w for w in self.waves if w == w]
+    
+    def judge_score(self, wave_idx, judge):
+        """One judge's score for a wave, or None if not entered"""
+        if self.panel is None:
+            return None
+        score = self.panel[wave_idx * MAX_JUDGES + judge]
+        return None if score != score else score
+    
+    def set_judge_score(self, wave_idx, judge, score):
+        if self.panel is None:
+            self.panel = array('d', [EMPTY_WAVE]) * (len(self.waves) * MAX_JUDGES)
+        self.panel[wave_idx * MAX_JUDGES + judge] = EMPTY_WAVE if score is None else score
+    
+    def clear(self):
+        """Wipe scores and interference (heat reset)"""
+        self.waves = array('d', [EMPTY_WAVE]) * len(self.waves)
+        self.interference = 0
+        self.interference_waves = []
+        self.panel = None
+    
+    def copy(self):
+        surfer = Surfer(self.color, 0)
+        surfer.name = self.name
+        surfer.goal = self.goal
+        surfer.waves = array('d', self.waves)
+        surfer.interference = self.interference
+        surfer.interference_waves = list(self.interference_waves)
+        surfer.panel = None if self.panel is None else array('d', self.panel)
+        return surfer
+    
+    def to_dict(self):
+        data = {
+            'color': self.color,
+            'name': self.name,
+            'goal': self.goal,
+            'waves': [None if w != w else w for w in self.waves],
+            'interference': self.interference,
+            'interference_waves': self.interference_waves
+        }
+        if self.panel is not None:
+            # One row of judge scores per wave
+            scores = [None if s != s else s for s in self.panel]
+            data['panel'] = [scores[start:start + MAX_JUDGES] for start in range(0, len(scores), MAX_JUDGES)]
+        return data
+    
+    @classmethod
+    def from_dict(cls, data):
+        surfer = cls(data['color'], len(data['waves']))
+        surfer.name = data.get('name', '')
+        surfer.goal = data.get('goal', 0)
+        surfer.waves = array('d', (EMPTY_WAVE if w is None else w for w in data['waves']))
+        surfer.interference = data.get('interference', 0)
+        surfer.interference_waves = list(data.get('interference_waves', []))
+        if data.get('panel'):
+            surfer.panel = array('d', (EMPTY_WAVE if s is None else s for row in data['panel'] for s in row))
+        return surfer
+
+class Heat:
+    """A heat's metadata, surfers and priority order.
+    
+    to_dict()/from_dict() use the same JSON shape the app has always stored and
+    served: metadata, surfers (waves as a list with null for empty) and priority_order,
+    plus the event log once there is one.
+    
+    log records every score and interference change as [t, kind, surfer_idx,
+    wave_idx, value], t in seconds from the heat start; kind is 'score' (value
+    None = cleared), 'interference' (wave_idx None) or 'mark' (value True/False).
+    """
+    
+    __slots__ = ('metadata', 'surfers', 'priority_order', 'log')
+    
+    def __init__(self, surfer_count=5, wave_cap=20, metadata=None):
+        self.metadata = {
+            'heat_number': '',
+            'category': '',
+            'round': '',
+            'location': '',
+            'duration': 20,  # minutes
+            'start_time': None,
+            'is_closed': False,
+            'notes': ''
+        }
+        if metadata:
+            self.metadata.update(metadata)
+        self.surfers = [Surfer(color, wave_cap) for color in JERSEY_COLORS[:surfer_count]]
+        self.priority_order = []  # Empty = no priority established yet
+        self.log = []
+    
+    @property
+    def wave_cap(self):
+        return len(self.surfers[0].waves)
+    
+    def surfer_index(self):
+        """Lowercase jersey color -> surfer index"""
+        return {surfer.color.lower(): idx for idx, surfer in enumerate(self.surfers)}
+    
+    def copy(self):
+        heat = Heat(0)
+        heat.metadata = dict(self.metadata)
+        heat.surfers = [surfer.copy() for surfer in self.surfers]
+        heat.priority_order = list(self.priority_order)
+        heat.log = list(self.log)  # Events are never changed once logged
+        return heat
+    
+    def to_dict(self):
+        data = {
+            'metadata': self.metadata,
+            'surfers': [surfer.to_dict() for surfer in self.surfers],
+            'priority_order': self.priority_order
+        }
+        if self.log:
+            data['log'] = self.log
+        return data
+    
+    @classmethod
+    def from_dict(cls, data):
+        heat = cls(0)
+        heat.metadata = data['metadata']
+        heat.surfers = [Surfer.from_dict(surfer) for surfer in data['surfers']]
+        heat.priority_order = list(data['priority_order'])
+        if 'log' in data:
+            heat.log = data['log']
+        else:
+            # Scored before heats kept a log: count those scores from the start
+            for idx, surfer in enumerate(heat.surfers):
+                heat.log.extend([0.0, 'score', idx, wave_idx, score]
+                                for wave_idx, score in enumerate(surfer.waves) if score == score)
+                if surfer.interference:
+                    heat.log.append([0.0, 'interference', idx, None, surfer.interference])
+        return heat
+
+def new_heat(surfer_count=5, wave_cap=20, metadata=None):
+    """A fresh, empty heat"""
+    return Heat(surfer_count, wave_cap, metadata)
+
+# Session tracker for coaching (persists across heats): per-athlete aggregates,
+# kept up to date as heats close, plus each athlete's full heat history
+ATHLETE_FIELDS = ('name', 'goal', 'heat_count', 'mean', 'best', 'last', 'status')
+ATHLETE_SORTS = ('name', 'heat_count', 'mean', 'best', 'last')
+HISTORY_FIELDS = ('heat_id', 'heat_number', 'category', 'round', 'position', 'color',
+                  'total', 'waves', 'closed_at')
+
+def goal_status(best, goal):
+    """Tracker status of an athlete's best heat total against their goal"""
+    if best >= goal and goal > 0:
+        if best > goal:
+            return 'Above Goal'
+        return 'Goal Hit!'
+    elif goal > 0:
+        return 'In Progress'
+    return '-'
+
+def new_athlete(name, goal):
+    return {'name': name, 'goal': goal, 'heat_count': 0, 'mean': 0.0, 'best': 0.0, 'last': None,
+            'status': goal_status(0, goal)}
+
+def add_athlete_heat(athlete, total):
+    """Fold one more heat total into an athlete's aggregates (in place)"""
+    athlete['heat_count'] += 1
+    athlete['mean'] += (total - athlete['mean']) / athlete['heat_count']  # Running mean
+    athlete['best'] = max(athlete['best'], total)
+    athlete['last'] = total
+    athlete['status'] = goal_status(athlete['best'], athlete['goal'])
+    return athlete
+
+def refold_athlete(athlete, totals):
+    """The athlete's aggregates recomputed from all their heat totals, oldest first"""
+    refolded = new_athlete(athlete['name'], athlete['goal'])
+    for total in totals:
+        add_athlete_heat(refolded, total)
+    return refolded
+
+def legacy_tracker_entries(tracker):
+    """History entries for a pre-athlete-store tracker ({name: {'heats': [...], 'goal': X}})"""
+    for name, info in tracker.items():
+        for total in info.get('heats', []):
+            if total is not None:
+                yield dict(dict.fromkeys(HISTORY_FIELDS), name=name, goal=info.get('goal') or 0,
+                           total=total, waves=[])
+
+def parse_scoring(spec):
+    """Validate a scoring spec ({'best_waves', 'interference', 'tiebreak'}, each optional)
+    and return it complete; raises ValueError with a user-facing message"""
+    if not isinstance(spec, dict):
+        raise ValueError('scoring must be an object')
+    parsed = DEFAULT_SCORING.spec()
+    parsed.update(spec)
+    best_waves = parsed['best_waves']
+    if isinstance(best_waves, bool) or not isinstance(best_waves, int) or not 1 <= best_waves <= MAX_WAVE_CAP:
+        raise ValueError(f'best_waves must be between 1 and {MAX_WAVE_CAP}')
+    if parsed['interference'] not in INTERFERENCE_SCHEMES:
+        raise ValueError(f"interference must be one of {', '.join(INTERFERENCE_SCHEMES)}")
+    if parsed['tiebreak'] not in TIEBREAKS:
+        raise ValueError(f"tiebreak must be one of {', '.join(TIEBREAKS)}")
+    return {field: parsed[field] for field in ('best_waves', 'interference', 'tiebreak')}
+
+def scoring_rule(metadata):
+    """The heat's compiled ScoringRule: metadata 'scoring', else best two waves, ISA, countback"""
+    spec = metadata.get('scoring')
+    if not spec:
+        return DEFAULT_SCORING
+    try:
+        return compile_scoring(**parse_scoring(spec))
+    except ValueError:
+        return DEFAULT_SCORING
+
+class RankingEngine:
+    """Keeps each surfer's sorted waves and the ordered leaderboard up to date as scores change.
+    
+    A score edit re-sorts only the surfer that changed (bisect into the sorted waves,
+    bisect the surfer's key back into the leaderboard) instead of rebuilding every
+    surfer's result and re-sorting the whole heat. Totals, penalties and tiebreaks
+    come from the heat's ScoringRule.
+    """
+    
+    def __init__(self, surfers, rule=DEFAULT_SCORING):
+        self.surfers = surfers
+        self.rule = rule
+        self.rebuild()
+    
+    def rebuild(self, surfers=None, rule=None):
+        """Rebuild all state from the surfer dicts (after a reset, a bulk load or a rule change)"""
+        if surfers is not None:
+            self.surfers = surfers
+        if rule is not None:
+            self.rule = rule
+        self._waves = []    # Per surfer: valid waves, ascending (bisect order)
+        self._entries = []  # Per surfer: cached result dict without 'position'
+        self._keys = []     # Per surfer: current leaderboard key
+        self._board = []    # Leaderboard keys, ascending (best surfer last)
+        self._needs = None  # (revision, advancing, needs) from the last needs() call
+        self.revision = 0   # Bumped on every re-rank
+        for idx, surfer in enumerate(self.surfers):
+            self._waves.append(sorted(surfer.valid_waves()))
+            self._entries.append(None)
+            self._keys.append(None)
+            self._refresh(idx)
+    
+    def set_wave(self, surfer_idx, wave_idx, score):
+        """Set (or clear with None) one wave slot and re-rank that surfer"""
+        surfer = self.surfers[surfer_idx]
+        old = surfer.wave(wave_idx)
+        surfer.waves[wave_idx] = EMPTY_WAVE if score is None else score
+        waves = self._waves[surfer_idx]
+        if old is not None:
+            del waves[bisect.bisect_left(waves, old)]
+        if score is not None:
+            bisect.insort(waves, score)
+        self._refresh(surfer_idx)
+    
+    def set_interference(self, surfer_idx, interference):
+        """Set a surfer's interference code (0-6) and re-rank that surfer"""
+        self.surfers[surfer_idx].interference = interference
+        self._refresh(surfer_idx)
+    
+    def _refresh(self, idx):
+        surfer = self.surfers[idx]
+        valid_waves = self._waves[idx][::-1]
+        counting = valid_waves[:self.rule.best_waves]
+        total = self.rule.total(counting, surfer.interference)
+        
+        self._entries[idx] = {
+            'idx': idx,
+            'color': surfer.color,
+            'top_waves': counting,
+            'all_waves_sorted': valid_waves,  # All waves sorted for tiebreaker
+            'total': total,
+            'all_waves': surfer.valid_waves(),
+            'interference': surfer.interference
+        }
+        
+        key = self._key(idx, valid_waves, total)
+        old_key = self._keys[idx]
+        if old_key is not None:
+            del self._board[bisect.bisect_left(self._board, old_key)]
+        bisect.insort(self._board, key)
+        self._keys[idx] = key
+        self.revision += 1
+    
+    def _key(self, idx, valid_waves, total=None):
+        """Leaderboard key for surfer idx scoring valid_waves (sorted high to low)"""
+        rule = self.rule
+        if total is None:
+            total = rule.total(valid_waves[:rule.best_waves], self.surfers[idx].interference)
+        return rule.key(total, valid_waves, len(self.surfers[idx].waves), idx)
+    
+    def _beats(self, idx, extra, target):
+        """Whether surfer idx, with the extra wave scores added, ranks above the target key"""
+        waves = list(self._waves[idx])
+        for score in extra:
+            bisect.insort(waves, score)
+        return self._key(idx, waves[::-1]) > target
+    
+    def _lowest(self, beats):
+        """Lowest score (0.00-10.00 in hundredths) for which beats(score) holds, or None"""
+        if not beats(10.0):
+            return None
+        lo, hi = 0, 1000
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if beats(mid / 100):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo / 100
     
-    for idx, surfer in enumerate(current_heat['surfers']):
-        valid_waves = [w for w in surfer['waves'] if w is not None]
-        valid_waves.sort(reverse=True)
-        top_two = valid_waves[:2] if len(valid_waves) >= 2 else valid_waves
+    def _needs_against(self, idx, target):
+        """What surfer idx needs to rank above the target key.
         
-        # Apply interference penalty - ISA Official Rules
-        # interference: 0 = None
-        # 1 = INT-1: Halve 2nd highest (non-priority)
-        # 2 = INT-2: Zero 2nd highest (priority)
-        # 3 = INT-3: Zero highest (last 5min interference)
-        # 4 = 2x INT (non-priority + priority): Halve highest, Zero 2nd
-        # 5 = 2x INT (both priority): Zero both (effectively DQ)
-        # 6 = DQ: Disqualified (total = 0)
-        total = sum(top_two)
+        'wave' is the lowest single wave that does it. When no single wave can,
+        'combo' is the lowest two-wave sum that does: the penalties are linear
+        in the top two waves, so the cheapest pair is either a 10 plus the
+        lowest second wave or two equal waves, and both are checked.
+        """
+        wave = self._lowest(lambda score: self._beats(idx, (score,), target))
+        combo = None
+        if wave is None:
+            with_ten = self._lowest(lambda score: self._beats(idx, (10.0, score), target))
+            pair = self._lowest(lambda score: self._beats(idx, (score, score), target))
+            sums = [10.0 + score for score in (with_ten,) if score is not None]
+            sums += [2 * score for score in (pair,) if score is not None]
+            if sums:
+                combo = round(min(sums), 2)
+        return {'wave': wave, 'combo': combo}
+    
+    def needs(self, advancing):
+        """Per surfer index, what it takes to reach 1st and each advancing place above them.
         
-        if surfer['interference'] == 1 and len(top_two) >= 2:
-            # INT-1: Halve second highest scoring ride (non-priority)
-            total -= (top_two[1] / 2)
-        elif surfer['interference'] == 2 and len(top_two) >= 2:
-            # INT-2: Second highest scoring ride = zero (priority)
-            total -= top_two[1]
-        elif surfer['interference'] == 3 and len(top_two) >= 1:
-            # INT-3: Highest scoring ride = zero (last 5min WSG/Olympic)
-            total -= top_two[0]
-        elif surfer['interference'] == 4:
-            # 2 Interferences: one non-priority + one priority
-            # INT-1 on highest + INT-2 on second highest
-            if len(top_two) >= 1:
-                total -= (top_two[0] / 2)  # Halve highest
-            if len(top_two) >= 2:
-                total -= top_two[1]  # Zero second highest
-        elif surfer['interference'] == 5:
-            # 2 Interferences: both priority OR one in last 5min
-            # Both rides = zero (effectively disqualified from scoring)
-            if len(top_two) >= 1:
-                total -= top_two[0]  # Zero highest
-            if len(top_two) >= 2:
-                total -= top_two[1]  # Zero second highest
-        elif surfer['interference'] == 6:
-            # Disqualification: total = 0
+        Each entry is {'place', 'wave', 'combo'} against the current scores of
+        everyone else, with the surfer's own interference penalty applied and
+        ties resolved by the usual countback. Cached until the next re-rank.
+        """
+        if self._needs and self._needs[:2] == (self.revision, advancing):
+            return self._needs[2]
+        board = self._board[::-1]
+        needs = {}
+        for pos, key in enumerate(board, 1):
+            idx = -key[-1]
+            needs[idx] = [
+                dict(place=place, **self._needs_against(idx, board[place - 1]))
+                for place in range(1, min(advancing, pos - 1) + 1)
+            ]
+        self._needs = (self.revision, advancing, needs)
+        return needs
+    
+    def leader(self):
+        """(surfer index, total) of the surfer in 1st"""
+        key = self._board[-1]
+        return -key[-1], key[0]
+    
+    def rankings(self, advancing=None):
+        """Return the leaderboard as result dicts with 'position' set
+        (and 'needs' when the number of advancing places is given)"""
+        needs = self.needs(advancing) if advancing else None
+        results = []
+        for pos, key in enumerate(reversed(self._board), 1):
+            result = dict(self._entries[-key[-1]])
+            result['position'] = pos
+            if needs is not None:
+                result['needs'] = needs[result['idx']]
+            results.append(result)
+        return results
+
+def heat_engine(data):
+    """A RankingEngine for a Heat under its own scoring rule"""
+    return RankingEngine(data.surfers, scoring_rule(data.metadata))
+
+def advancing_places(heat):
+    """How many surfers advance from the heat: metadata 'advancing', else 1 man-on-man and 2 otherwise"""
+    try:
+        advancing = int(heat.data.metadata.get('advancing') or 0)
+    except (TypeError, ValueError):
+        advancing = 0
+    if advancing < 1:
+        advancing = 1 if len(heat.data.surfers) <= 2 else 2
+    return advancing
+
+def panel_config(metadata):
+    """(judges, aggregation) from heat metadata: 'judges' is the panel size, 1 (a single
+    score per wave, the default) to MAX_JUDGES; 'aggregation' one of AGGREGATIONS"""
+    try:
+        judges = int(metadata.get('judges') or 1)
+    except (TypeError, ValueError):
+        judges = 1
+    aggregation = metadata.get('aggregation')
+    return min(max(judges, 1), MAX_JUDGES), aggregation if aggregation in AGGREGATIONS else AGGREGATIONS[0]
+
+def panel_aggregator(judges, aggregation):
+    """Function from one wave's judge scores to its official score, to hundredths.
+    
+    drop_high_low discards the highest and lowest score and averages the rest (a plain
+    mean for panels under 3). An unentered score is NaN, which carries through the sums,
+    so a wave stays unscored until the whole panel has scored it.
+    """
+    if aggregation == 'median':
+        mid = judges // 2
+        def official(scores):
+            if any(s != s for s in scores):
+                return EMPTY_WAVE
+            scores = sorted(scores)
+            return round(scores[mid] if judges % 2 else (scores[mid - 1] + scores[mid]) / 2, 2)
+        return official
+    if aggregation == 'drop_high_low' and judges >= 3:
+        return lambda scores: round((sum(scores) - max(scores) - min(scores)) / (judges - 2), 2)
+    return lambda scores: round(sum(scores) / judges, 2)
+
+def aggregate_panel(surfer, judges, aggregation):
+    """Official scores for all of a surfer's waves from their panel, as a waves array"""
+    official = panel_aggregator(judges, aggregation)
+    panel = surfer.panel
+    return array('d', [official(panel[start:start + judges]) for start in range(0, len(panel), MAX_JUDGES)])
+
+def calculate_rankings(heat):
+    """Calculate live rankings for all surfers with proper tiebreaker logic"""
+    with RANKING_SECONDS.timer():
+        return heat.engine.rankings(advancing_places(heat))
+
+def calculate_needs(rankings):
+    """Needs (single wave) and needs-combo (two waves) for every surfer, leaderboard
+    order, from rankings calculated with the advancing places"""
+    return [
+        {'idx': result['idx'], 'color': result['color'], 'position': result['position'],
+         'total': result['total'], 'needs': result['needs']}
+        for result in rankings
+    ]
+
+def build_priority_display(heat):
+    """Priority order for display: surfers without priority first as TIED, then the queue"""
+    surfers = heat.data.surfers
+    priority_order = heat.data.priority_order
+    
+    # Include surfers NOT in priority_order as "tied"
+    all_surfers = set(range(len(surfers)))
+    surfers_in_order = set(priority_order)
+    tied_surfers = all_surfers - surfers_in_order
+    
+    priority_display = []
+    
+    # Show tied surfers first
+    if tied_surfers:
+        for idx in sorted(tied_surfers):
+            priority_display.append({
+                'position': 'TIED',
+                'color': surfers[idx].color,
+                'idx': idx
+            })
+    
+    # Then show ordered surfers
+    for position, idx in enumerate(priority_order, len(tied_surfers) + 1):
+        priority_display.append({
+            'position': position,
+            'color': surfers[idx].color,
+            'idx': idx
+        })
+    
+    return priority_display
+
+# Instrumentation: latency and size histograms for /metrics (Prometheus text
+# format) and an on-demand sampling profiler. Both are per process; with several
+# gunicorn workers each scrape sees the worker that answered it.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # seconds
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)  # bytes
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Histogram:
+    """A Prometheus histogram with fixed buckets and one series per label values.
+    
+    observe() is a bisect and two additions under a lock, cheap enough to run on
+    every request and every re-rank.
+    """
+    
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket (last is +Inf)..., sum]
+        self._lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+    
+    @contextmanager
+    def timer(self, *label_values):
+        """Observe the time spent in the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+    
+    def render(self):
+        """Exposition lines: cumulative buckets, sum and count for each series"""
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for label_values, values in series:
+            labels = ','.join(f'{name}="{_label_value(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
             total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                total += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {total}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {values[-1]:.6f}')
+            lines.append(f'{self.name}_count{suffix} {total}')
+        return lines
+
+REQUEST_SECONDS = Histogram('surf_judge_request_seconds',
+                            'Request latency (to the first byte for streamed responses)', ('route', 'method'))
+RESPONSE_BYTES = Histogram('surf_judge_response_bytes', 'Response body size', ('route',), SIZE_BUCKETS)
+RANKING_SECONDS = Histogram('surf_judge_ranking_seconds', 'Leaderboard (with needs) compute time')
+EXPORT_SECONDS = Histogram('surf_judge_export_seconds',
+                           'Export time, from request to the whole file', ('format',))
+
+PROFILER_MAX_STACKS = 5000  # Distinct stacks kept; rarer ones are counted as "[other]"
+
+class SamplingProfiler:
+    """Samples every thread's Python stack on a timer while switched on.
+    
+    Stacks are counted in folded form ("outer;inner;innermost count" per line),
+    which flamegraph.pl and speedscope read directly. Nothing runs while it is
+    off; while on, one daemon thread walks the stacks every interval.
+    """
+    
+    def __init__(self):
+        self.interval = 0.005
+        self.samples = 0
+        self.started_at = None
+        self._stacks = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+    
+    @property
+    def enabled(self):
+        return self._thread is not None
+    
+    def start(self, interval=None):
+        with self._lock:
+            if interval:
+                self.interval = interval
+            if self._thread is None:
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True)
+                self.started_at = time.time()
+                self._thread.start()
+    
+    def stop(self):
+        with self._lock:
+            if self._thread is not None:
+                self._stop.set()
+                self._thread = None
+    
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+    
+    def _run(self, stop):
+        me = threading.get_ident()
+        while not stop.wait(self.interval):
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(stack)))
+            with self._lock:
+                for stack in stacks:
+                    if stack in self._stacks or len(self._stacks) < PROFILER_MAX_STACKS:
+                        self._stacks[stack] += 1
+                    else:
+                        self._stacks['[other]'] += 1
+                self.samples += 1
+    
+    def folded(self):
+        """Counted stacks, most frequent first"""
+        with self._lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
+    
+    def to_dict(self):
+        return {
+            'enabled': self.enabled,
+            'interval': self.interval,
+            'samples': self.samples,
+            'stacks': len(self._stacks),
+            'started_at': self.started_at
+        }
+
+profiler = SamplingProfiler()
+
+class LiveFeed:
+    """Fans one heat's changes out to every /stream subscriber.
+    
+    Each change is serialized to a Server-Sent Events frame once, kept in a short
+    history so reconnecting clients can resume from their Last-Event-ID, and the
+    latest frame of each event type is kept so new clients start in sync.
+    
+    With a shared state store, events are appended to the store instead and the
+    event relay thread delivers them, so subscribers see changes made by any worker.
+    """
+    
+    def __init__(self, heat_id, history=500):
+        self.heat_id = heat_id
+        self._cond = threading.Condition()
+        self._frames = deque(maxlen=history)  # (event_id, frame bytes)
+        self._latest = {}  # event type -> (event_id, frame bytes)
+        self._last_id = 0
+        self.subscribers = 0
+    
+    @property
+    def last_id(self):
+        return self._last_id
+    
+    def publish(self, event, payload):
+        data = json.dumps(payload, separators=(',', ':'))
+        if state_store.shared:
+            # Delivered to local subscribers by the relay, like everyone else's
+            state_store.append_event(self.heat_id, event, data)
+            return
+        with self._cond:
+            self.deliver(self._last_id + 1, event, data)
+    
+    def deliver(self, event_id, event, data):
+        """Record one event and wake subscribers (called with the lock held)"""
+        if event_id <= self._last_id:
+            return  # Already seen (loaded with the heat and relayed again)
+        frame = f"id: {event_id}\nevent: {event}\ndata: {data}\n\n".encode('utf-8')
+        self._frames.append((event_id, frame))
+        self._latest[event] = (event_id, frame)
+        self._last_id = event_id
+        self._cond.notify_all()
+    
+    def ingest(self, rows):
+        """Deliver (event_id, event, data) rows read from the shared store"""
+        with self._cond:
+            for event_id, event, data in rows:
+                self.deliver(event_id, event, data)
+    
+    def _backlog(self, last_id):
+        """Frames a subscriber still needs after last_id (called with the lock held)"""
+        if (last_id is not None and last_id <= self._last_id
+                and self._frames and self._frames[0][0] <= last_id + 1):
+            return [frame for event_id, frame in self._frames if event_id > last_id]
+        # New client, or one we can't resume (missed too much, restarted server):
+        # send the latest state of each type
+        return [frame for event_id, frame in sorted(self._latest.values())]
+    
+    def subscribe(self, last_id=None, heartbeat=15):
+        """Generator of SSE frames; yields a comment line as heartbeat when idle"""
+        with self._cond:
+            pending = self._backlog(last_id)
+            seen = self._last_id
+            self.subscribers += 1
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                for frame in pending:
+                    yield frame
+                with self._cond:
+                    if self._last_id == seen:
+                        self._cond.wait(timeout=heartbeat)
+                    if self._last_id == seen:
+                        pending = [b": heartbeat\n\n"]
+                        continue
+                    pending = self._backlog(seen)
+                    seen = self._last_id
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+class Journal:
+    """Append-only on-disk log of heat operations with periodic snapshots.
+    
+    Used by the in-memory store so a restarted process gets its heats back:
+    restore() loads the latest snapshot and replays the journal lines after it.
+    Appends only queue a line; a background thread writes and fsyncs whatever
+    has queued up every few milliseconds (group commit), so scoring requests
+    never wait on the disk.
+    """
+    
+    def __init__(self, directory, snapshot_every=2000, flush_interval=0.05):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.flush_interval = flush_interval
+        self.journal_path = os.path.join(directory, 'journal.log')
+        self.snapshot_path = os.path.join(directory, 'snapshot.json')
+        self.seq = 0  # Sequence number of the last appended operation
+        self.since_snapshot = 0
+        self._queue = deque()  # Journal lines and snapshot documents, in order
+        self._queued = 0  # Items ever queued
+        self._durable = 0  # Items ever written and fsynced
+        self._cond = threading.Condition()
+        self._writer = None
+        os.makedirs(directory, exist_ok=True)
+    
+    def restore(self):
+        """Return (snapshot state or None, operations logged after it)"""
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self.seq = snapshot['seq']
         
-        # Ensure total doesn't go negative
-        total = max(0, total)
+        ops = []
+        if os.path.exists(self.journal_path):
+            valid = 0  # Bytes up to the end of the last complete line
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # Torn last line from a crash mid-write
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        break
+                    valid += len(line)
+                    if op['seq'] > self.seq:
+                        ops.append(op)
+                        self.seq = op['seq']
+                torn = f.seek(0, os.SEEK_END) > valid
+            if torn:
+                # Cut it off, or the writer would append after it and the next
+                # restore would stop there and lose everything written since
+                os.truncate(self.journal_path, valid)
+        self.since_snapshot = len(ops)
+        return (snapshot['state'] if snapshot else None), ops
+    
+    def append(self, op):
+        """Queue one operation; returns True when it is time for a snapshot"""
+        self.seq += 1
+        self.since_snapshot += 1
+        line = json.dumps(dict(op, seq=self.seq), separators=(',', ':')) + '\n'
+        with self._cond:
+            self._queue.append(line)
+            self._queued += 1
+            self._start_writer()
+        return self.since_snapshot >= self.snapshot_every
+    
+    def snapshot(self, state):
+        """Queue a snapshot of state as of the last appended operation"""
+        document = json.dumps({'seq': self.seq, 'state': state}, separators=(',', ':'))
+        self.since_snapshot = 0
+        with self._cond:
+            self._queue.append(('snapshot', document))
+            self._queued += 1
+            self._start_writer()
+    
+    def _start_writer(self):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+            atexit.register(self.flush)
+        self._cond.notify()
+    
+    def _write_loop(self):
+        journal = open(self.journal_path, 'a', encoding='utf-8')
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                items = list(self._queue)
+                self._queue.clear()
+            
+            for item in items:
+                if isinstance(item, str):
+                    journal.write(item)
+                    continue
+                # Snapshot: make it durable, then start an empty journal after it
+                journal.flush()
+                os.fsync(journal.fileno())
+                tmp_path = self.snapshot_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(item[1])
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+                journal.close()
+                journal = open(self.journal_path, 'w', encoding='utf-8')
+            journal.flush()
+            os.fsync(journal.fileno())
+            
+            with self._cond:
+                # Only now, not when the queue was taken, is the batch safe
+                self._durable += len(items)
+                self._cond.notify_all()
+            time.sleep(self.flush_interval)  # Let the next group of appends collect
+    
+    def flush(self, timeout=5):
+        """Wait until everything queued so far is written and fsynced"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            target = self._queued
+            while self._durable < target and time.monotonic() < deadline:
+                self._cond.wait(timeout=self.flush_interval)
+
+class MemoryStateStore:
+    """Heat state kept only in this process's memory.
+    
+    Evicted heats stay here as plain dicts. Each gunicorn worker would hold its
+    own copy, so only use it with a single worker. Without a journal nothing
+    survives a restart (dev mode); with one, every operation is logged and the
+    heats are restored on startup.
+    
+    The store keeps its own copy of each committed heat, never the live one a
+    transaction is changing, so writes to different heats run side by side (each
+    heat's lock orders its own writers) and a journal snapshot never catches a
+    half-applied change. Tracker changes made in a transaction that then fails
+    are undone.
+    """
+    
+    shared = False
+    
+    def __init__(self, journal=None):
+        self._heats = {}  # heat_id -> [version, data]
+        self._athletes = {}  # name -> aggregates (ATHLETE_FIELDS)
+        self._athlete_names = []  # Sorted, for name-ordered pages
+        self._history = {}  # name -> heat results, oldest first
+        self._tracker_version = 0
+        self._lock = threading.RLock()  # Guards the dicts above, briefly; not held for a transaction
+        self._undo = threading.local()  # .log: tracker changes of this thread's open transaction
+        self.journal = journal
+    
+    @contextmanager
+    def transaction(self):
+        if getattr(self._undo, 'log', None) is not None:
+            yield self  # Nested: the outer transaction commits or undoes
+            return
+        self._undo.log = []
+        try:
+            yield self
+        except BaseException:
+            self._undo_tracker(self._undo.log)
+            raise
+        finally:
+            self._undo.log = None
+    
+    def _undo_tracker(self, log):
+        """Reverse the tracker changes in log: drop added history entries, put back
+        updated ones and refold the athletes they belong to"""
+        if not log:
+            return
+        with self._lock:
+            names = set()
+            for change in reversed(log):
+                name, item = change[1], change[2]
+                history = self._history[name]
+                if change[0] == 'add':
+                    del history[next(i for i, entry in enumerate(history) if entry is item)]
+                else:
+                    item.update(change[3])
+                names.add(name)
+            for name in names:
+                if self._history[name]:
+                    self._athletes[name] = refold_athlete(
+                        self._athletes[name], [entry['total'] for entry in self._history[name]])
+                else:
+                    del self._athletes[name], self._history[name]
+                    self._athlete_names.remove(name)
+            self._tracker_version += 1
+    
+    def _log_undo(self, *change):
+        log = getattr(self._undo, 'log', None)
+        if log is not None:
+            log.append(change)
+    
+    def heat_version(self, heat_id):
+        entry = self._heats.get(heat_id)
+        return entry[0] if entry else None
+    
+    def heat_versions(self, heat_ids):
+        """heat_id -> version for those of heat_ids that exist"""
+        heats = self._heats
+        return {heat_id: heats[heat_id][0] for heat_id in heat_ids if heat_id in heats}
+    
+    def read_heat(self, heat_id):
+        entry = self._heats.get(heat_id)
+        return (entry[0], entry[1].copy()) if entry else (None, None)
+    
+    def write_heat(self, heat_id, data, ops=()):
+        data = data.copy()
+        with self._lock:
+            # Journal appends and snapshots in version order, whichever heat wrote
+            entry = self._heats.setdefault(heat_id, [0, data])
+            entry[0] += 1
+            entry[1] = data
+            if self.journal is not None:
+                snapshot_due = False
+                for op in ops:
+                    snapshot_due = self.journal.append(dict(op, heat_id=heat_id, version=entry[0]))
+                if snapshot_due:
+                    self.journal.snapshot(self._state())
+            return entry[0]
+    
+    def create_heat(self, heat_id, data, ops=()):
+        """Store a new heat; returns its version, or None if the id is taken"""
+        with self._lock:
+            if heat_id in self._heats:
+                return None
+            return self.write_heat(heat_id, data, ops)
+    
+    def _state(self):
+        return {
+            'heats': {heat_id: {'version': version, 'data': data.to_dict()}
+                      for heat_id, (version, data) in self._heats.items()},
+            'athletes': {'version': self._tracker_version, 'athletes': self._athletes,
+                         'history': self._history}
+        }
+    
+    def restore(self):
+        """Rebuild heats and tracker from the journal's snapshot plus its tail"""
+        if self.journal is None:
+            return
+        state, ops = self.journal.restore()
+        if state:
+            self._heats = {heat_id: [entry['version'], Heat.from_dict(entry['data'])]
+                           for heat_id, entry in state['heats'].items()}
+            if 'athletes' in state:
+                self._athletes = state['athletes']['athletes']
+                self._athlete_names = sorted(self._athletes)
+                self._history = state['athletes']['history']
+                self._tracker_version = state['athletes']['version']
+            elif state['tracker']['data']:
+                # Snapshot from before the athlete store
+                self.record_results(list(legacy_tracker_entries(state['tracker']['data'])))
         
-        results.append({
-            'idx': idx,
-            'color': surfer['color'],
-            'top_waves': top_two,
-            'all_waves_sorted': valid_waves,  # All waves sorted for tiebreaker
-            'total': total,
-            'all_waves': [w for w in surfer['waves'] if w is not None],
-            'interference': surfer['interference']
-        })
+        replaying = {}
+        for op in ops:
+            heat_id = op['heat_id']
+            heat = replaying.get(heat_id)
+            if heat is None:
+                version, data = self._heats.get(heat_id, (0, new_heat()))
+                heat = replaying[heat_id] = HeatState(heat_id, version, data)
+            if op['op'] == 'create_heat':
+                heat.load(heat.version, new_heat(op.get('surfer_count', 5), op.get('wave_cap', 20),
+                                                 op.get('metadata')))
+            else:
+                apply_operation(heat, op, self)
+            heat.version = op['version']
+        for heat_id, heat in replaying.items():
+            self._heats[heat_id] = [heat.version, heat.data]
+    
+    def list_heats(self):
+        return [(heat_id, entry[0], entry[1].metadata) for heat_id, entry in self._heats.items()]
+    
+    def heat_count(self):
+        return len(self._heats)
+    
+    def tracker_version(self):
+        return self._tracker_version
+    
+    def record_results(self, entries):
+        """Add closed-heat results (HISTORY_FIELDS plus name and goal) to the athletes"""
+        with self._lock:
+            for entry in entries:
+                name = entry['name']
+                athlete = self._athletes.get(name)
+                if athlete is None:
+                    athlete = self._athletes[name] = new_athlete(name, entry['goal'])
+                    bisect.insort(self._athlete_names, name)
+                    self._history[name] = []
+                add_athlete_heat(athlete, entry['total'])
+                item = {field: entry[field] for field in HISTORY_FIELDS}
+                self._history[name].append(item)
+                self._log_undo('add', name, item)
+            self._tracker_version += 1
+            return self._tracker_version
+    
+    def update_results(self, heat_id, entries):
+        """Re-scored results of a closed heat: each athlete's history entries for it
+        take the new position, total and waves, and their aggregates are refolded"""
+        with self._lock:
+            for entry in entries:
+                history = self._history.get(entry['name'], ())
+                matched = False
+                for item in history:
+                    if item['heat_id'] == heat_id:
+                        self._log_undo('update', entry['name'], item,
+                                       {field: item[field] for field in ('position', 'total', 'waves')})
+                        item.update(position=entry['position'], total=entry['total'], waves=entry['waves'])
+                        matched = True
+                if matched:
+                    self._athletes[entry['name']] = refold_athlete(
+                        self._athletes[entry['name']], [item['total'] for item in history])
+            self._tracker_version += 1
+            return self._tracker_version
+    
+    def athlete(self, name):
+        with self._lock:
+            athlete = self._athletes.get(name)
+            return dict(athlete) if athlete else None
+    
+    def query_athletes(self, search='', status=None, sort='name', descending=False, offset=0, limit=50):
+        """(matching count, one page of athletes), ties in name order"""
+        search = search.lower()
+        with self._lock:
+            rows = [self._athletes[name] for name in self._athlete_names
+                    if search in name.lower()
+                    and (status is None or self._athletes[name]['status'] == status)]
+        if sort != 'name' or descending:
+            rows.sort(key=lambda athlete: athlete[sort], reverse=descending)
+        return len(rows), [dict(athlete) for athlete in rows[offset:offset + limit]]
+    
+    def athlete_history(self, name, offset=0, limit=50, newest_first=False):
+        with self._lock:
+            history = self._history.get(name, [])
+            if newest_first:
+                history = history[::-1]
+            return [dict(entry) for entry in history[offset:offset + limit]]
+    
+    def max_heats(self):
+        with self._lock:
+            return max((athlete['heat_count'] for athlete in self._athletes.values()), default=0)
+    
+    def iter_totals(self):
+        """(athlete, [(heat_id, total), ...]) for every athlete in name order, one at a time"""
+        with self._lock:
+            names = list(self._athlete_names)
+        for name in names:
+            with self._lock:
+                yield (dict(self._athletes[name]),
+                       [(entry['heat_id'], entry['total']) for entry in self._history[name]])
+
+class SQLiteStateStore:
+    """Heat state shared by every worker through a local SQLite database in WAL mode.
+    
+    Each heat is one JSON row with a version number. The session tracker is an
+    athletes table of running aggregates plus an athlete_heats history, both
+    indexed for paged queries. Writers serialize on BEGIN IMMEDIATE; readers only
+    compare versions and, thanks to WAL, never wait for a writer. Stream events
+    go in the same database so every worker can fan them out.
+    """
+    
+    shared = True
+    
+    def __init__(self, path, keep_events=5000):
+        self.path = path
+        self.keep_events = keep_events
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS heats ("
+                     "heat_id TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS state ("
+                     "key TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS heat_events ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT, heat_id TEXT NOT NULL, "
+                     "event TEXT NOT NULL, data TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS heat_events_by_heat ON heat_events (heat_id, id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS athletes ("
+                     "name TEXT PRIMARY KEY, goal REAL NOT NULL, heat_count INTEGER NOT NULL, "
+                     "mean REAL NOT NULL, best REAL NOT NULL, last REAL, status TEXT NOT NULL)")
+        for column in ('heat_count', 'mean', 'best', 'last', 'status'):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS athletes_by_{column} ON athletes ({column}, name)")
+        conn.execute("CREATE TABLE IF NOT EXISTS athlete_heats ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, heat_id TEXT, "
+                     "heat_number TEXT, category TEXT, round TEXT, position INTEGER, color TEXT, "
+                     "total REAL NOT NULL, waves TEXT NOT NULL, closed_at TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS athlete_heats_by_name ON athlete_heats (name, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS athlete_heats_by_heat ON athlete_heats (heat_id)")
+        self._migrate_tracker()
+    
+    def _migrate_tracker(self):
+        """Move a session tracker stored as one JSON blob into the athlete tables"""
+        with self.transaction():
+            row = self._connection().execute(
+                "SELECT data FROM state WHERE key = 'session_tracker'").fetchone()
+            if row:
+                self.record_results(list(legacy_tracker_entries(json.loads(row[0]))))
+                self._connection().execute("DELETE FROM state WHERE key = 'session_tracker'")
+    
+    def _connection(self):
+        """One connection per thread, in autocommit mode (transactions are explicit)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    
+    def heat_version(self, heat_id):
+        row = self._connection().execute(
+            "SELECT version FROM heats WHERE heat_id = ?", (heat_id,)).fetchone()
+        return row[0] if row else None
+    
+    def heat_versions(self, heat_ids):
+        """heat_id -> version for those of heat_ids that exist"""
+        heat_ids = list(heat_ids)
+        versions = {}
+        conn = self._connection()
+        for start in range(0, len(heat_ids), 500):  # Under SQLite's bound parameter limit
+            chunk = heat_ids[start:start + 500]
+            versions.update(conn.execute(
+                f"SELECT heat_id, version FROM heats WHERE heat_id IN ({', '.join('?' * len(chunk))})",
+                chunk).fetchall())
+        return versions
+    
+    def read_heat(self, heat_id):
+        row = self._connection().execute(
+            "SELECT version, data FROM heats WHERE heat_id = ?", (heat_id,)).fetchone()
+        return (row[0], Heat.from_dict(json.loads(row[1]))) if row else (None, None)
+    
+    def write_heat(self, heat_id, data, ops=()):
+        version = (self.heat_version(heat_id) or 0) + 1
+        self._connection().execute(
+            "INSERT OR REPLACE INTO heats (heat_id, version, data) VALUES (?, ?, ?)",
+            (heat_id, version, json.dumps(data.to_dict(), separators=(',', ':'))))
+        return version
+    
+    def create_heat(self, heat_id, data, ops=()):
+        """Store a new heat; returns its version, or None if the id is taken"""
+        with self.transaction():
+            if self.heat_version(heat_id) is not None:
+                return None
+            return self.write_heat(heat_id, data, ops)
+    
+    def list_heats(self):
+        rows = self._connection().execute(
+            "SELECT heat_id, version, json_extract(data, '$.metadata') FROM heats").fetchall()
+        return [(heat_id, version, json.loads(metadata)) for heat_id, version, metadata in rows]
+    
+    def heat_count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM heats").fetchone()[0]
+    
+    def tracker_version(self):
+        row = self._connection().execute(
+            "SELECT version FROM state WHERE key = 'athletes'").fetchone()
+        return row[0] if row else 0
+    
+    def record_results(self, entries):
+        """Add closed-heat results to the athletes (call inside a transaction)"""
+        conn = self._connection()
+        for entry in entries:
+            row = conn.execute("SELECT * FROM athletes WHERE name = ?", (entry['name'],)).fetchone()
+            athlete = dict(zip(ATHLETE_FIELDS, row)) if row else new_athlete(entry['name'], entry['goal'])
+            add_athlete_heat(athlete, entry['total'])
+            conn.execute("INSERT OR REPLACE INTO athletes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         [athlete[field] for field in ATHLETE_FIELDS])
+            conn.execute("INSERT INTO athlete_heats (name, heat_id, heat_number, category, round, "
+                         "position, color, total, waves, closed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (entry['name'], entry['heat_id'], entry['heat_number'], entry['category'],
+                          entry['round'], entry['position'], entry['color'], entry['total'],
+                          json.dumps(entry['waves']), entry['closed_at']))
+        version = self.tracker_version() + 1
+        conn.execute("INSERT OR REPLACE INTO state (key, version, data) VALUES ('athletes', ?, '{}')",
+                     (version,))
+        return version
+    
+    def update_results(self, heat_id, entries):
+        """Re-scored results of a closed heat (call inside a transaction)"""
+        conn = self._connection()
+        for entry in entries:
+            updated = conn.execute(
+                "UPDATE athlete_heats SET position = ?, total = ?, waves = ? WHERE name = ? AND heat_id = ?",
+                (entry['position'], entry['total'], json.dumps(entry['waves']), entry['name'], heat_id)).rowcount
+            if updated:
+                athlete = self.athlete(entry['name'])
+                totals = [row[0] for row in conn.execute(
+                    "SELECT total FROM athlete_heats WHERE name = ? ORDER BY id", (entry['name'],))]
+                athlete = refold_athlete(athlete, totals)
+                conn.execute("INSERT OR REPLACE INTO athletes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             [athlete[field] for field in ATHLETE_FIELDS])
+        version = self.tracker_version() + 1
+        conn.execute("INSERT OR REPLACE INTO state (key, version, data) VALUES ('athletes', ?, '{}')",
+                     (version,))
+        return version
+    
+    def athlete(self, name):
+        row = self._connection().execute("SELECT * FROM athletes WHERE name = ?", (name,)).fetchone()
+        return dict(zip(ATHLETE_FIELDS, row)) if row else None
+    
+    def query_athletes(self, search='', status=None, sort='name', descending=False, offset=0, limit=50):
+        """(matching count, one page of athletes), ties in name order"""
+        assert sort in ATHLETE_SORTS
+        where, params = [], []
+        if search:
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where.append("name LIKE ? ESCAPE '\\'")
+            params.append(f'%{escaped}%')
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        clause = ' WHERE ' + ' AND '.join(where) if where else ''
+        conn = self._connection()
+        count = conn.execute(f"SELECT COUNT(*) FROM athletes{clause}", params).fetchone()[0]
+        order = 'DESC' if descending else 'ASC'
+        rows = conn.execute(f"SELECT * FROM athletes{clause} ORDER BY {sort} {order}, name "
+                            "LIMIT ? OFFSET ?", params + [limit, offset]).fetchall()
+        return count, [dict(zip(ATHLETE_FIELDS, row)) for row in rows]
+    
+    def athlete_history(self, name, offset=0, limit=50, newest_first=False):
+        order = 'DESC' if newest_first else 'ASC'
+        rows = self._connection().execute(
+            f"SELECT {', '.join(HISTORY_FIELDS)} FROM athlete_heats WHERE name = ? "
+            f"ORDER BY id {order} LIMIT ? OFFSET ?", (name, limit, offset)).fetchall()
+        return [self._history_entry(row) for row in rows]
+    
+    @staticmethod
+    def _history_entry(row):
+        entry = dict(zip(HISTORY_FIELDS, row))
+        entry['waves'] = json.loads(entry['waves'])
+        return entry
+    
+    def max_heats(self):
+        return self._connection().execute("SELECT MAX(heat_count) FROM athletes").fetchone()[0] or 0
+    
+    def iter_totals(self):
+        """(athlete, [(heat_id, total), ...]) for every athlete in name order, one at a time"""
+        conn = self._connection()
+        totals = conn.execute("SELECT name, heat_id, total FROM athlete_heats ORDER BY name, id")
+        row = next(totals, None)
+        for athlete in conn.execute("SELECT * FROM athletes ORDER BY name"):
+            athlete = dict(zip(ATHLETE_FIELDS, athlete))
+            heats = []
+            while row is not None and row[0] <= athlete['name']:
+                if row[0] == athlete['name']:
+                    heats.append((row[1], row[2]))
+                row = next(totals, None)
+            yield athlete, heats
+    
+    def append_event(self, heat_id, event, data):
+        conn = self._connection()
+        event_id = conn.execute("INSERT INTO heat_events (heat_id, event, data) VALUES (?, ?, ?)",
+                                (heat_id, event, data)).lastrowid
+        if event_id % 100 == 0:
+            conn.execute("DELETE FROM heat_events WHERE id <= ?", (event_id - self.keep_events,))
+        return event_id
+    
+    def last_event_id(self):
+        row = self._connection().execute("SELECT MAX(id) FROM heat_events").fetchone()
+        return row[0] or 0
+    
+    def events_after(self, last_id):
+        return self._connection().execute(
+            "SELECT id, heat_id, event, data FROM heat_events WHERE id > ? ORDER BY id",
+            (last_id,)).fetchall()
+    
+    def recent_events(self, heat_id, limit):
+        rows = self._connection().execute(
+            "SELECT id, event, data FROM heat_events WHERE heat_id = ? ORDER BY id DESC LIMIT ?",
+            (heat_id, limit)).fetchall()
+        return rows[::-1]
+
+# SURF_JUDGE_STATE=memory keeps the old single-process behaviour (dev mode);
+# add SURF_JUDGE_JOURNAL=<directory> to make it survive restarts
+if os.environ.get('SURF_JUDGE_STATE', 'sqlite') == 'memory':
+    journal_dir = os.environ.get('SURF_JUDGE_JOURNAL')
+    state_store = MemoryStateStore(Journal(journal_dir) if journal_dir else None)
+else:
+    state_store = SQLiteStateStore(os.environ.get(
+        'SURF_JUDGE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'surf_judge.db')))
+startup_phase('state_store')
+
+DEFAULT_HEAT_ID = 'main'
+HEAT_ID_CHARS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_')
+MAX_RESIDENT_HEATS = 64     # Heats kept in memory before the least recently used is evicted
+HEAT_IDLE_SECONDS = 30 * 60  # Evict heats nobody has touched for this long...
+CLOSED_HEAT_IDLE_SECONDS = 5 * 60  # ...or closed heats after this long
+RANKINGS_HISTORY = 64  # Past leaderboards kept per heat for ?since= deltas
+
+class UnknownHeat(KeyError):
+    """Raised for a heat id that is not in the store"""
+
+class UnknownEvent(KeyError):
+    """Raised for an event id with no bracket heats"""
+
+class VersionConflict(Exception):
+    """A write expected a heat version that is no longer current"""
+    
+    def __init__(self, heat_id, version, expected):
+        super().__init__(f'Heat {heat_id} is at version {version}, not {expected}')
+        self.heat_id = heat_id
+        self.version = version
+        self.expected = expected
+
+TIMELINE_CHECKPOINT = 32  # Events between stored replay states
+
+class HeatTimeline:
+    """A heat's event log indexed by time: the leaderboard as of any second of the
+    heat, and every lead change.
+    
+    Events are sorted by time once. Every TIMELINE_CHECKPOINT events the replay
+    state (each surfer's waves and interference) is kept, so a leaderboard as of t
+    bisects to its event, restores the checkpoint before it and replays at most
+    that many events. Lead changes come from replaying the log through the
+    incremental ranking engine. When the next version of the heat has only
+    appended events in time order, its timeline takes over that replay and adds
+    just the new events instead of starting again.
+    """
+    
+    def __init__(self, data, previous=None):
+        self.colors = [surfer.color for surfer in data.surfers]
+        self.rule = scoring_rule(data.metadata)
+        self._lock = threading.Lock()
+        state = previous._take_over(data.log, self.rule) if previous is not None else None
+        if state is None:
+            self.events, self.times, self.checkpoints, self.lead_changes = [], [], [], []
+            self._surfers = [Surfer(surfer.color, len(surfer.waves)) for surfer in data.surfers]
+            self._engine = RankingEngine(self._surfers, self.rule)
+            self._leader = None
+            new_events = sorted(data.log, key=lambda event: event[0])  # Stable: same-time events keep log order
+        else:
+            (self.events, self.times, self.checkpoints, self.lead_changes,
+             self._surfers, self._engine, self._leader), new_events = state
+        self._count = len(data.log)
+        self._last_logged = data.log[-1] if data.log else None
+        self._replay(new_events)
+    
+    def _replay(self, new_events):
+        surfers = self._surfers
+        engine = self._engine
+        for event in new_events:
+            position = len(self.events)
+            if position % TIMELINE_CHECKPOINT == 0 and len(self.checkpoints) == position // TIMELINE_CHECKPOINT:
+                self.checkpoints.append(self._state(surfers))
+            self.events.append(event)
+            self.times.append(event[0])
+            t, kind, surfer_idx, wave_idx, value = event
+            if kind == 'score':
+                engine.set_wave(surfer_idx, wave_idx, value)
+            elif kind == 'interference':
+                engine.set_interference(surfer_idx, value)
+            else:
+                continue  # Wave marks do not change the ranking
+            idx, total = engine.leader()
+            if total <= 0:
+                idx = None  # Nobody leads until someone scores
+            if idx != self._leader:
+                self._leader = idx
+                self.lead_changes.append({'t': t, 'idx': idx, 'total': total,
+                                          'color': None if idx is None else self.colors[idx]})
+        position = len(self.events)
+        if position % TIMELINE_CHECKPOINT == 0 and len(self.checkpoints) == position // TIMELINE_CHECKPOINT:
+            self.checkpoints.append(self._state(surfers))
+    
+    def _take_over(self, log, rule):
+        """This timeline's replay state and the events still to replay, for the next
+        version's log; None if that log is not this one plus later events"""
+        with self._lock:
+            if (self._engine is None or rule is not self.rule or len(log) < self._count
+                    or (self._count and log[self._count - 1] is not self._last_logged)):
+                return None
+            new_events = log[self._count:]
+            last = self.times[-1] if self.times else 0.0
+            for event in new_events:
+                if event[0] < last:
+                    return None  # Entered offline earlier: the order has to be rebuilt
+                last = event[0]
+            engine, self._engine = self._engine, None  # Only one successor can continue it
+        return (list(self.events), list(self.times), list(self.checkpoints), list(self.lead_changes),
+                self._surfers, engine, self._leader), new_events
+    
+    @staticmethod
+    def _state(surfers):
+        return [(array('d', surfer.waves), surfer.interference) for surfer in surfers]
+    
+    def surfers_at(self, t):
+        """Every surfer's waves and interference as of t seconds (events at t included),
+        and how many events that is"""
+        end = bisect.bisect_right(self.times, t)
+        checkpoint = end // TIMELINE_CHECKPOINT
+        surfers = []
+        for color, (waves, interference) in zip(self.colors, self.checkpoints[checkpoint]):
+            replayed = Surfer(color, 0)
+            replayed.waves = array('d', waves)
+            replayed.interference = interference
+            surfers.append(replayed)
+        for t, kind, surfer_idx, wave_idx, value in self.events[checkpoint * TIMELINE_CHECKPOINT:end]:
+            if kind == 'score':
+                surfers[surfer_idx].waves[wave_idx] = EMPTY_WAVE if value is None else value
+            elif kind == 'interference':
+                surfers[surfer_idx].interference = value
+        return surfers, end
+    
+    def rankings_at(self, t, advancing=None):
+        surfers, end = self.surfers_at(t)
+        return RankingEngine(surfers, self.rule).rankings(advancing), end
+
+def heat_timeline(snapshot):
+    """The snapshot's HeatTimeline, built on first use (continuing an earlier
+    version's where it can)"""
+    if snapshot.timeline is None:
+        snapshot.timeline = HeatTimeline(snapshot.data, snapshot.previous_timeline)
+        snapshot.previous_timeline = None
+    return snapshot.timeline
+
+class HeatSnapshot:
+    """One committed version of a heat, as readers see it.
+    
+    Writers build a new snapshot from a private copy of the heat when they commit
+    and swap it in with a single assignment, so reads never take the heat lock and
+    never see a half-applied change. Serialized responses for this version are
+    cached in payloads: name -> (version, etag, body).
+    """
+    
+    __slots__ = ('heat_id', 'version', 'data', 'rankings', 'priority_order', 'payloads',
+                 'timeline', 'previous_timeline')
+    
+    def __init__(self, heat_id, version, data, engine):
+        self.heat_id = heat_id
+        self.version = version
+        self.data = data
+        with RANKING_SECONDS.timer():
+            self.rankings = engine.rankings(advancing_places(self))
+        self.priority_order = build_priority_display(self)
+        self.payloads = {}
+        self.timeline = None  # HeatTimeline, built on first use
+        self.previous_timeline = None  # The latest earlier one, for it to continue
+
+class HeatState:
+    """One live heat: its data, ranking engine, stream feed and latest snapshot"""
+    
+    def __init__(self, heat_id, version, data):
+        self.heat_id = heat_id
+        self.version = version
+        self.data = data
+        self.engine = heat_engine(data)
+        self.feed = LiveFeed(heat_id)
+        self.lock = threading.RLock()  # Held by writers only
+        self.last_used = time.monotonic()
+        self.pending_ops = []  # Operations applied in the open transaction
+        self.history = deque(maxlen=RANKINGS_HISTORY)  # (version, rankings) of recent snapshots
+        self.snapshot = None
+        self.take_snapshot()
+    
+    def load(self, version, data):
+        """Replace this heat's data with a newer stored copy"""
+        self.version = version
+        self.data = data
+        self.engine.rebuild(data.surfers, scoring_rule(data.metadata))
+        if version > self.snapshot.version:
+            self.take_snapshot()
+    
+    def take_snapshot(self):
+        """Publish the current data to readers (called with the lock held)"""
+        self.publish(HeatSnapshot(self.heat_id, self.version, self.data.copy(), self.engine))
+    
+    def publish(self, snapshot):
+        """Make snapshot the one readers see, remembering its rankings for deltas"""
+        self.history.append((snapshot.version, snapshot.rankings))
+        previous = self.snapshot
+        if previous is not None:
+            snapshot.previous_timeline = previous.timeline or previous.previous_timeline
+        self.snapshot = snapshot
+    
+    def rankings_at(self, version):
+        """Rankings as of an earlier version, or None if it is no longer remembered"""
+        for past_version, rankings in reversed(self.history):
+            if past_version == version:
+                return rankings
+        return None
+
+# Resident heats in least-recently-used order: heat_id -> HeatState
+heats = OrderedDict()
+heats_lock = threading.Lock()
+
+
+def evict_idle_heats():
+    """Drop idle or closed heats from memory (called with heats_lock held).
+    
+    Heats are persisted by every write, so eviction is just forgetting them. Only
+    the least recently used end of the registry is looked at.
+    """
+    now = time.monotonic()
+    while heats:
+        heat_id, heat = next(iter(heats.items()))
+        idle = now - heat.last_used
+        limit = CLOSED_HEAT_IDLE_SECONDS if heat.snapshot.data.metadata.get('is_closed') else HEAT_IDLE_SECONDS
+        if len(heats) <= MAX_RESIDENT_HEATS and idle < limit:
+            break
+        if heat.feed.subscribers:
+            # Someone is watching it live; keep it and look again later
+            heat.last_used = now
+            heats.move_to_end(heat_id)
+            if len(heats) <= MAX_RESIDENT_HEATS:
+                break
+            continue
+        del heats[heat_id]
+
+def get_heat(heat_id):
+    """Return the up-to-date HeatState for heat_id, loading it from the store if needed"""
+    with heats_lock:
+        heat = heats.get(heat_id)
+        if heat is not None:
+            heats.move_to_end(heat_id)
+            heat.last_used = time.monotonic()
+        evict_idle_heats()
+    
+    if heat is None:
+        # Relay first, so no event lands between seeding the feed and relaying
+        start_event_relay()
+        version, data = state_store.read_heat(heat_id)
+        if data is None:
+            if heat_id != DEFAULT_HEAT_ID:
+                raise UnknownHeat(heat_id)
+            # The default heat always exists
+            version, data = 0, new_heat()
+        with heats_lock:
+            heat = heats.get(heat_id)
+            if heat is None:
+                heat = heats[heat_id] = HeatState(heat_id, version, data)
+                seed_feed(heat)
+        return heat
+    
+    # Pick up changes written by other workers since this process last looked.
+    # Only the snapshot is refreshed, without the heat lock; the next local write
+    # reloads the heat itself inside its transaction.
+    if state_store.shared and state_store.heat_version(heat_id) != heat.snapshot.version:
+        version, data = state_store.read_heat(heat_id)
+        if data is not None and version > heat.snapshot.version:
+            heat.publish(HeatSnapshot(heat_id, version, data, heat_engine(data)))
+    return heat
+
+class HeatWrite:
+    """An open heat transaction: the heat being changed and, once committed, its snapshot"""
     
-    # Sort with proper tiebreaker logic:
-    # 1. By total (descending)
-    # 2. If tied on total, by highest single wave (descending)
-    # 3. If still tied, by 3rd wave, 4th wave, etc.
-    def sort_key(result):
-        # Create tuple: (total, wave1, wave2, wave3, ...)
-        # Pad with 0s if fewer waves to ensure proper comparison
-        waves = result['all_waves_sorted'] + [0] * (20 - len(result['all_waves_sorted']))
-        return (result['total'],) + tuple(waves)
+    __slots__ = ('heat', 'snapshot')
     
-    results.sort(key=sort_key, reverse=True)
+    def __init__(self, heat):
+        self.heat = heat
+        self.snapshot = None
+
+@contextmanager
+def heat_transaction(heat_id, expected_version=None):
+    """Atomic read-modify-write of one heat (and the athlete store, which
+    close_heat writes in the same transaction) across threads and workers;
+    yields a HeatWrite.
+    
+    With expected_version set this is a compare-and-set: VersionConflict is
+    raised, and nothing written, unless the heat is still at that version.
+    """
+    heat = get_heat(heat_id)
+    with heat.lock:
+        heat.pending_ops = []
+        write = HeatWrite(heat)
+        try:
+            with state_store.transaction() as txn:
+                version = txn.heat_version(heat_id)
+                if version is not None and version != heat.version:
+                    heat.load(*txn.read_heat(heat_id))
+                if expected_version is not None and expected_version != heat.version:
+                    raise VersionConflict(heat_id, heat.version, expected_version)
+                yield write
+                heat.version = txn.write_heat(heat_id, heat.data, heat.pending_ops)
+            heat.take_snapshot()
+            write.snapshot = heat.snapshot
+        except VersionConflict:
+            raise  # Nothing was changed
+        except BaseException:
+            # The write was rolled back; reload the stored copy on next use, or (in
+            # memory, where nothing else writes) put back the last committed state
+            if state_store.shared:
+                heat.version = -1
+            else:
+                heat.load(heat.snapshot.version, heat.snapshot.data.copy())
+            raise
+        finally:
+            heat.pending_ops = []
+
+def create_heat(heat_id, metadata=None, surfer_count=5, wave_cap=20):
+    """Create and store a new empty heat; returns None if the id is taken"""
+    data = new_heat(surfer_count, wave_cap, metadata)
+    start_event_relay()
+    version = state_store.create_heat(heat_id, data, [{
+        'op': 'create_heat', 'metadata': metadata or {},
+        'surfer_count': surfer_count, 'wave_cap': wave_cap
+    }])
+    if version is None:
+        return None
+    with heats_lock:
+        heat = heats[heat_id] = HeatState(heat_id, version, data)
+        seed_feed(heat)
+    return heat
+
+def publish_rankings(heat, rankings=None):
+    """Push the heat's leaderboard to stream subscribers; returns the rankings"""
+    if rankings is None:
+        rankings = calculate_rankings(heat)
+    heat.feed.publish('rankings', {'rankings': rankings})
+    return rankings
+
+def publish_priority(heat):
+    """Push the heat's priority order to stream subscribers; returns the display list"""
+    priority_display = build_priority_display(heat)
+    heat.feed.publish('priority', {'priority_order': priority_display})
+    return priority_display
+
+def publish_heat_state(heat):
+    """Push heat metadata and every surfer's interference state to stream subscribers"""
+    heat.feed.publish('heat', {
+        'metadata': heat.data.metadata,
+        'interference': [
+            {'idx': idx, 'interference': surfer.interference,
+             'interference_waves': surfer.interference_waves}
+            for idx, surfer in enumerate(heat.data.surfers)
+        ]
+    })
+
+# Heat mutations that can be validated up front and applied in batches
+OPERATIONS = ('set_score', 'set_judge_score', 'set_interference', 'toggle_interference',
+              'mark_interference_wave', 'toggle_priority')
+
+def _index(value, size, name):
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value < size:
+        raise ValueError(f'Invalid {name}')
+    return value
+
+MAX_OPERATION_AGE_MS = 24 * 3600 * 1000
+
+def operation_time(age_ms=None):
+    """When an operation was entered, as an ISO timestamp: now, less age_ms for one
+    that waited in a device's offline queue (measured on the device's own clock,
+    so its clock does not have to agree with the server's)"""
+    now = datetime.now()
+    if isinstance(age_ms, (int, float)) and not isinstance(age_ms, bool) and 0 < age_ms <= MAX_OPERATION_AGE_MS:
+        now -= timedelta(milliseconds=age_ms)
+    return now.isoformat()
+
+def heat_elapsed(metadata, at):
+    """Seconds from the heat start to the ISO timestamp at, to tenths; 0 before the
+    timer was started"""
+    start = metadata.get('start_time')
+    if not start or not at:
+        return 0.0
+    try:
+        elapsed = (datetime.fromisoformat(at) - datetime.fromisoformat(start)).total_seconds()
+    except (TypeError, ValueError):
+        return 0.0
+    return max(0.0, round(elapsed, 1))
+
+def log_event(heat, op, kind, surfer_idx, wave_idx, value):
+    """Append a change to the heat's event log, stamped with the operation's time"""
+    heat.data.log.append([heat_elapsed(heat.data.metadata, op.get('at')), kind, surfer_idx, wave_idx, value])
+
+def parse_operation(heat, op):
+    """Validate one mutation against the heat's layout and return it normalized.
+    
+    Raises ValueError with a user-facing message. Validation does not depend on
+    the heat's scores, so a validated list of operations always applies cleanly.
+    """
+    if not isinstance(op, dict) or op.get('op') not in OPERATIONS:
+        raise ValueError('Unknown operation')
+    kind = op['op']
+    parsed = {'op': kind, 'surfer_idx': _index(op.get('surfer_idx'), len(heat.data.surfers), 'surfer'),
+              'at': operation_time(op.get('age_ms'))}
+    
+    if kind in ('set_score', 'set_judge_score', 'mark_interference_wave'):
+        parsed['wave_idx'] = _index(op.get('wave_idx'), heat.data.wave_cap, 'wave')
+    if kind == 'set_judge_score':
+        parsed['judge'] = _index(op.get('judge'), panel_config(heat.data.metadata)[0], 'judge')
+    
+    if kind in ('set_score', 'set_judge_score'):
+        score = op.get('score')
+        if score == '' or score is None:
+            parsed['score'] = None
+        else:
+            try:
+                parsed['score'] = float(score)
+            except (TypeError, ValueError):
+                raise ValueError('Invalid score')
+            if not 0 <= parsed['score'] <= 10:
+                raise ValueError('Score must be between 0 and 10')
+    elif kind == 'set_interference':
+        parsed['interference'] = _index(op.get('interference'), 7, 'interference code')
+    elif kind == 'mark_interference_wave' and op.get('marked') is not None:
+        # Explicit state instead of a toggle, so replays are idempotent
+        parsed['marked'] = bool(op['marked'])
+    return parsed
+
+def apply_operation(heat, op, athletes=None):
+    """Apply one parsed operation; returns which views changed ('rankings', 'priority', 'heat').
+    
+    Besides the batchable operations above, the heat-level routes (metadata, surfers,
+    timer, close/reopen/reset) are operations too, so every change to a heat can be
+    journaled and replayed the same way.
+    """
+    kind = op['op']
+    heat.pending_ops.append(op)
+    metadata = heat.data.metadata
+    
+    if kind == 'update_metadata':
+        metadata.update(op['metadata'])
+        rescore = 'scoring' in op['metadata']
+        if 'judges' in op['metadata'] or 'aggregation' in op['metadata']:
+            # New panel rules: re-aggregate every judged wave, logging each official
+            # score that changes so replays agree with the live leaderboard. Stamped
+            # here (and so journaled) unless the caller already did
+            op.setdefault('at', operation_time())
+            judges, aggregation = panel_config(metadata)
+            for surfer_idx, surfer in enumerate(heat.data.surfers):
+                if surfer.panel is not None:
+                    waves = aggregate_panel(surfer, judges, aggregation)
+                    for wave_idx, score in enumerate(waves):
+                        score = None if score != score else score
+                        if surfer.wave(wave_idx) != score:
+                            log_event(heat, op, 'score', surfer_idx, wave_idx, score)
+                    surfer.waves = waves
+            rescore = True
+        if rescore:
+            heat.engine.rebuild(rule=scoring_rule(metadata))
+            return {'rankings', 'heat'}
+        return {'heat'}
+    
+    if kind == 'rescore_heat':
+        # A rule change or upheld protest: re-rank under the (new) rule and, if the
+        # heat is closed, correct the results it gave the athlete store
+        if op.get('scoring') is not None:
+            metadata['scoring'] = op['scoring']
+        heat.engine.rebuild(rule=scoring_rule(metadata))
+        if metadata.get('is_closed'):
+            (state_store if athletes is None else athletes).update_results(
+                heat.heat_id, heat_result_entries(heat))
+        return {'rankings', 'heat'}
+    
+    if kind == 'update_surfers':
+        for color, idx in heat.data.surfer_index().items():
+            if color in op['surfers']:
+                heat.data.surfers[idx].name = op['surfers'][color].get('name', '')
+                heat.data.surfers[idx].goal = op['surfers'][color].get('goal', 0)
+        return set()
+    
+    if kind == 'start_timer':
+        metadata['start_time'] = op['start_time']
+        return {'heat'}
+    
+    if kind == 'close_heat':
+        metadata['is_closed'] = True
+        record_heat_results(heat, state_store if athletes is None else athletes, op.get('closed_at'))
+        return {'heat'}
+    
+    if kind == 'reopen_heat':
+        metadata['is_closed'] = False
+        return {'heat'}
+    
+    if kind == 'reset_heat':
+        for surfer in heat.data.surfers:
+            surfer.clear()
+        metadata['start_time'] = None
+        metadata['is_closed'] = False
+        metadata['notes'] = ''
+        heat.data.priority_order = []  # Reset to no priority
+        heat.data.log = []
+        heat.engine.rebuild()
+        return {'rankings', 'priority', 'heat'}
+    
+    surfer_idx = op['surfer_idx']
+    surfer = heat.data.surfers[surfer_idx]
+    
+    if kind == 'set_score':
+        if surfer.wave(op['wave_idx']) != op['score']:
+            log_event(heat, op, 'score', surfer_idx, op['wave_idx'], op['score'])
+        heat.engine.set_wave(surfer_idx, op['wave_idx'], op['score'])
+        return {'rankings'}
+    
+    if kind == 'set_judge_score':
+        # Re-aggregate just this wave and feed the official score to the ranking
+        judges, aggregation = panel_config(metadata)
+        wave_idx = op['wave_idx']
+        surfer.set_judge_score(wave_idx, op['judge'], op['score'])
+        start = wave_idx * MAX_JUDGES
+        score = panel_aggregator(judges, aggregation)(surfer.panel[start:start + judges])
+        score = None if score != score else score
+        if surfer.wave(wave_idx) != score:
+            log_event(heat, op, 'score', surfer_idx, wave_idx, score)
+        heat.engine.set_wave(surfer_idx, wave_idx, score)
+        return {'rankings'}
+    
+    if kind in ('set_interference', 'toggle_interference'):
+        # Toggle cycles through: 0 -> 1 -> 2 -> 3 -> 4 -> 5 -> 6 -> 0
+        interference = op.get('interference', (surfer.interference + 1) % 7)
+        if interference != surfer.interference:
+            log_event(heat, op, 'interference', surfer_idx, None, interference)
+        heat.engine.set_interference(surfer_idx, interference)
+        return {'rankings', 'heat'}
+    
+    if kind == 'mark_interference_wave':
+        interference_waves = surfer.interference_waves
+        wave_idx = op['wave_idx']
+        marked = op.get('marked', wave_idx not in interference_waves)
+        if marked != (wave_idx in interference_waves):
+            log_event(heat, op, 'mark', surfer_idx, wave_idx, marked)
+        if wave_idx in interference_waves and not marked:
+            # Unmark
+            interference_waves.remove(wave_idx)
+        elif wave_idx not in interference_waves and marked:
+            # Mark with triangle
+            interference_waves.append(wave_idx)
+        return {'heat'}
+    
+    # toggle_priority: send the surfer to the back of the priority queue
+    priority_order = heat.data.priority_order
+    if surfer_idx in priority_order:
+        priority_order.remove(surfer_idx)
+    priority_order.append(surfer_idx)
+    return {'priority'}
+
+def heat_result_entries(heat, closed_at=None):
+    """Athlete store entries (HISTORY_FIELDS plus name and goal) for each named surfer"""
+    results = {result['color']: result for result in calculate_rankings(heat)}
+    metadata = heat.data.metadata
+    entries = []
+    
+    for surfer in heat.data.surfers:
+        name = (surfer.name or '').strip()
+        
+        if name:  # Only track if name is provided
+            result = results[surfer.color]
+            entries.append({
+                'name': name,
+                'goal': surfer.goal or 0,
+                'heat_id': heat.heat_id,
+                'heat_number': metadata['heat_number'],
+                'category': metadata['category'],
+                'round': metadata['round'],
+                'position': result['position'],
+                'color': surfer.color,
+                'total': result['total'],
+                'waves': surfer.valid_waves(),  # Every scored wave, for wave distributions
+                'closed_at': closed_at
+            })
+    return entries
+
+def record_heat_results(heat, athletes, closed_at=None):
+    """Add each named surfer's heat result to the athlete store"""
+    entries = heat_result_entries(heat, closed_at)
+    if entries:
+        athletes.record_results(entries)
+
+def run_operation(heat_id, op, expected_version=None):
+    """Apply one trusted heat-level operation in its own transaction and publish
+    what changed; returns the committed HeatSnapshot"""
+    with heat_transaction(heat_id, expected_version) as write:
+        heat = write.heat
+        changed = apply_operation(heat, op)
+        if 'rankings' in changed:
+            publish_rankings(heat)
+        if 'priority' in changed:
+            publish_priority(heat)
+        if 'heat' in changed:
+            publish_heat_state(heat)
+    return write.snapshot
+
+RESCORE_WORKERS = int(os.environ.get('SURF_JUDGE_RESCORE_WORKERS', str(min(4, os.cpu_count() or 1))))  # Threads for /rescore
+
+def rescore_heats(heat_ids, scoring=None, workers=RESCORE_WORKERS):
+    """Re-score many heats in one pass, optionally switching them to a new scoring spec.
+    
+    Each heat is its own journaled rescore_heat operation (closed heats also
+    correct the athlete store). The heats are independent, so they are spread over
+    a pool of workers threads. Returns per heat its new version and finishing order,
+    and whether that order changed.
+    """
+    op = {'op': 'rescore_heat'}
+    if scoring is not None:
+        op['scoring'] = scoring
+    
+    def rescore(heat_id):
+        before = [result['color'] for result in get_heat(heat_id).snapshot.rankings]
+        snapshot = run_operation(heat_id, op)
+        order = [result['color'] for result in snapshot.rankings]
+        if order != before:
+            advance_bracket(snapshot)  # New qualifiers move on, if the next heat has not started
+        return {'heat_id': heat_id, 'version': snapshot.version, 'order': order, 'changed': order != before}
+    
+    if workers <= 1 or len(heat_ids) <= 1:
+        return [rescore(heat_id) for heat_id in heat_ids]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(rescore, heat_ids))
+
+class InvalidOperation(ValueError):
+    """An operation in a batch failed validation; index is its position"""
     
-    # Add position
-    for pos, result in enumerate(results, 1):
-        result['position'] = pos
+    def __init__(self, message, index=0):
+        super().__init__(message)
+        self.index = index
+
+def apply_operations(heat_id, ops, expected_version=None):
+    """Validate all operations, then apply them in one transaction and publish each
+    changed view once. Returns the committed HeatSnapshot."""
+    snapshot = get_heat(heat_id).snapshot
+    parsed = []
+    for index, op in enumerate(ops):
+        try:
+            parsed.append(parse_operation(snapshot, op))
+        except ValueError as error:
+            raise InvalidOperation(str(error), index)
+    
+    changed = set()
+    with heat_transaction(heat_id, expected_version) as write:
+        heat = write.heat
+        for op in parsed:
+            changed |= apply_operation(heat, op)
+        if 'rankings' in changed:
+            publish_rankings(heat)
+        if 'priority' in changed:
+            publish_priority(heat)
+        if 'heat' in changed:
+            publish_heat_state(heat)
+    return write.snapshot
+
+def seed_feed(heat):
+    """Give a newly loaded heat's feed its recent events, or the current state"""
+    if state_store.shared:
+        heat.feed.ingest(state_store.recent_events(heat.heat_id, 50))
+        if heat.feed.last_id:
+            return
+    # Seed the feed so the first subscriber gets the full current state
+    publish_rankings(heat)
+    publish_priority(heat)
+    publish_heat_state(heat)
+    if state_store.shared:
+        heat.feed.ingest(state_store.recent_events(heat.heat_id, 50))
+
+event_relay = None
+event_relay_lock = threading.Lock()
+
+def relay_events(after, interval=0.2):
+    """Follow the shared store's event log and deliver to resident heats' feeds"""
+    while True:
+        time.sleep(interval)
+        try:
+            rows = state_store.events_after(after)
+        except sqlite3.Error:
+            continue
+        for event_id, heat_id, event, data in rows:
+            heat = heats.get(heat_id)
+            if heat is not None:
+                heat.feed.ingest([(event_id, event, data)])
+            after = event_id
+
+def start_event_relay():
+    """Start following the shared store's events (first heat loaded only)"""
+    global event_relay
+    if not state_store.shared or event_relay is not None:
+        return
+    with event_relay_lock:
+        if event_relay is None:
+            event_relay = threading.Thread(
+                target=relay_events, args=(state_store.last_event_id(),), daemon=True)
+            event_relay.start()
+
+tracker_payloads = {}  # Serialized session tracker responses, like HeatSnapshot.payloads
+PAYLOAD_CACHE_SIZE = 32  # Bodies kept per cache (one snapshot's, or the tracker's)
+
+def cached_json(cache, name, version, build):
+    """JSON response for build() that is serialized once per state version.
+    
+    The body is cached with a strong ETag (a hash of the body), so a poll that
+    sends the ETag back in If-None-Match gets a bodiless 304 while the version
+    is unchanged, and any other poll is served without recomputing anything.
+    """
+    return cached_body(cache, name, version, lambda: app.json.response(build()).get_data(),
+                       'application/json')
+
+def cached_body(cache, name, version, build, mimetype):
+    """Like cached_json, for a build() that returns the encoded body itself"""
+    entry = cache.get(name)
+    if entry is None or entry[0] != version:
+        body = build()
+        if entry is None and len(cache) >= PAYLOAD_CACHE_SIZE:
+            try:
+                del cache[next(iter(cache))]  # Oldest first
+            except (KeyError, RuntimeError, StopIteration):
+                pass  # Another request evicted at the same moment
+        entry = cache[name] = (version, hashlib.sha1(body).hexdigest()[:20], body)
+    
+    response = Response(entry[2], mimetype=mimetype)
+    response.set_etag(entry[1])
+    response.headers['Cache-Control'] = 'no-cache'  # Always revalidate, never stale
+    return response.make_conditional(request)
+
+PDF_WORKERS = int(os.environ.get('SURF_JUDGE_PDF_WORKERS', '1'))  # 0 renders in the request
+PDF_CACHE_SIZE = 32  # Rendered PDFs kept per process
+PDF_MAX_WAIT = 30  # Longest a request waits for a render, in seconds
+
+def export_filename(metadata, extension):
+    """Download name: category_heatnumber (e.g. "OpenMen_H1.pdf")"""
+    category_clean = metadata['category'].replace(' ', '') if metadata['category'] else 'Category'
+    heat_clean = metadata['heat_number'].replace(' ', '') if metadata['heat_number'] else 'Heat'
+    return f"{category_clean}_H{heat_clean}.{extension}"
+
+class PdfJob:
+    """One heat sheet render for a heat at one state version"""
+    
+    def __init__(self, heat_id, version, filename, future):
+        self.job_id = uuid.uuid4().hex
+        self.heat_id = heat_id
+        self.version = version
+        self.filename = filename
+        self.future = future
+    
+    @property
+    def status(self):
+        if not self.future.done():
+            return 'pending'
+        return 'failed' if self.future.exception() is not None else 'done'
+    
+    def wait(self, timeout):
+        """Wait up to timeout seconds for the render; returns the status"""
+        if timeout > 0:
+            wait_futures([self.future], timeout=timeout)
+        return self.status
+    
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'heat_id': self.heat_id,
+            'version': self.version,
+            'status': self.status,
+            'filename': self.filename,
+            'download': f'/pdf_jobs/{self.job_id}/pdf'
+        }
+
+class PdfRenderer:
+    """Renders heat sheets in a pool of worker processes and keeps the results.
+    
+    reportlab is slow and holds the GIL, so rendering in the request thread
+    stalls every scoring request in the worker. Jobs are keyed by (heat_id,
+    version): asking again for a heat that has not changed returns the same job,
+    so a closed heat is rendered once however often it is downloaded.
+    """
+    
+    def __init__(self, workers=PDF_WORKERS, cache_size=PDF_CACHE_SIZE):
+        self.workers = workers
+        self.cache_size = cache_size
+        self._pool = None
+        self._jobs = OrderedDict()  # (heat_id, version) -> PdfJob, least recently used first
+        self._by_id = {}  # job_id -> PdfJob
+        self._lock = threading.Lock()
+    
+    def _submit(self, data, results):
+        started = time.perf_counter()
+        future = self._start(data, results)
+        future.add_done_callback(lambda future: EXPORT_SECONDS.observe(time.perf_counter() - started, 'pdf'))
+        return future
+    
+    def _start(self, data, results):
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(render_heat_pdf(data, results))
+            except Exception as error:
+                future.set_exception(error)
+            return future
+        # The process pool machinery loads with the first render, not at boot
+        import multiprocessing
+        from concurrent.futures.process import BrokenProcessPool, ProcessPoolExecutor
+        for attempt in range(2):
+            if self._pool is None:
+                # spawn, not fork: this process runs threads (stream relay, journal writer)
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            try:
+                return self._pool.submit(render_heat_pdf, data, results)
+            except BrokenProcessPool:
+                # A render process died; start a fresh pool and retry once
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+        raise BrokenProcessPool('PDF render pool keeps failing')
+    
+    def request(self, heat):
+        """The render job for the heat's current version, started if needed"""
+        snapshot = heat.snapshot
+        key = (snapshot.heat_id, snapshot.version)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.status != 'failed':
+                self._jobs.move_to_end(key)
+                return job
+        # Snapshots are never changed, so they can be pickled to the pool as they are
+        data, results = snapshot.data.to_dict(), snapshot.rankings
+        
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job.status == 'failed':
+                if job is not None:
+                    del self._by_id[job.job_id]
+                job = PdfJob(key[0], key[1], export_filename(data['metadata'], 'pdf'), self._submit(data, results))
+                self._jobs[key] = job
+                self._by_id[job.job_id] = job
+            self._jobs.move_to_end(key)
+            # Forget the oldest finished renders; pending ones are still being polled
+            for old_key in [k for k, j in self._jobs.items() if j.status != 'pending']:
+                if len(self._jobs) <= self.cache_size:
+                    break
+                del self._by_id[self._jobs.pop(old_key).job_id]
+        return job
+    
+    def job_counts(self):
+        """Cached render jobs by status"""
+        with self._lock:
+            return Counter(job.status for job in self._jobs.values())
     
-    return results
+    def job(self, job_id):
+        with self._lock:
+            return self._by_id.get(job_id)
+    
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+pdf_renderer = PdfRenderer()
+atexit.register(pdf_renderer.shutdown)
+
+def requested_wait(default):
+    """Seconds the client is willing to wait (?wait=), capped at PDF_MAX_WAIT"""
+    try:
+        wait = float(request.args.get('wait', default))
+    except ValueError:
+        wait = default
+    return min(max(wait, 0), PDF_MAX_WAIT)
+
+def pdf_job_response(job, status):
+    """The finished PDF, or the job's state while it is pending or failed"""
+    if status == 'done':
+        return send_file(io.BytesIO(job.future.result()), mimetype='application/pdf',
+                         as_attachment=True, download_name=job.filename)
+    if status == 'failed':
+        return jsonify(dict(job.to_dict(), error=f'PDF render failed: {job.future.exception()}')), 500
+    return jsonify(job.to_dict()), 202, {'Location': f'/pdf_jobs/{job.job_id}', 'Retry-After': '1'}
+
+FORECAST_WORKERS = int(os.environ.get('SURF_JUDGE_FORECAST_WORKERS', str(os.cpu_count() or 1)))  # 1 simulates in the request
+FORECAST_SIMULATIONS = (2000, 20000, 200000)  # Heat endings a forecast may simulate; the middle is the default
+FORECAST_STEP = 15  # Seconds of heat clock a forecast stays current for
+FORECAST_HISTORY = 20  # Most recent past heats per athlete that feed the forecast
+DEFAULT_WAVE_RATE = 0.4  # Waves a minute, for a surfer with no history yet
+DEFAULT_WAVE_POOL = tuple(score / 2 for score in range(2, 17))  # 1.0-8.0, for a heat with no scores yet
+FORECAST_PRIOR_WAVES = 6  # How many of a surfer's own waves the heat-wide score pool counts as
+
+def heat_minutes(metadata):
+    """The heat's duration in minutes, or the default 20 if it is not a positive number"""
+    try:
+        minutes = float(metadata.get('duration'))
+    except (TypeError, ValueError):
+        return 20.0
+    return minutes if 0 < minutes < math.inf else 20.0
+
+def heat_remaining(metadata, now=None):
+    """Seconds left on the heat clock: the full duration before the timer starts, 0 once closed"""
+    duration = heat_minutes(metadata) * 60
+    if metadata.get('is_closed'):
+        return 0.0
+    if not metadata.get('start_time'):
+        return duration
+    return max(0.0, duration - heat_elapsed(metadata, (now or datetime.now()).isoformat()))
+
+def forecast_input(snapshot, remaining):
+    """The simulate_heat input for a snapshot with remaining seconds to go.
+    
+    Each surfer's wave rate and score pool come from their last FORECAST_HISTORY
+    heats in the session tracker plus this heat so far. Both are shrunk towards a
+    prior, so a surfer with little to go on is not forecast from one wave: the
+    rate towards DEFAULT_WAVE_RATE by one heat's worth (two quick waves at the
+    start do not forecast forty), the scores towards every wave in this heat plus
+    DEFAULT_WAVE_POOL, weighted as FORECAST_PRIOR_WAVES of their own.
+    """
+    data = snapshot.data
+    minutes = heat_minutes(data.metadata)
+    elapsed = max(0.0, minutes - remaining / 60) if data.metadata.get('start_time') else 0.0
+    prior = [score for surfer in data.surfers for score in surfer.valid_waves()] + list(DEFAULT_WAVE_POOL)
+    prior_weight = FORECAST_PRIOR_WAVES / len(prior)
+    surfers = []
+    for surfer in data.surfers:
+        waves = surfer.valid_waves()
+        past = []
+        if surfer.name:
+            # Newest first; one more in case this heat was closed once already
+            past = [entry for entry in state_store.athlete_history(surfer.name, 0, FORECAST_HISTORY + 1,
+                                                                   newest_first=True)
+                    if entry['heat_id'] != snapshot.heat_id][:FORECAST_HISTORY]
+        own = [score for entry in past for score in entry['waves'] if score is not None] + waves
+        caught = len(own) + DEFAULT_WAVE_RATE * minutes
+        rate = caught / (len(past) * minutes + elapsed + minutes)
+        surfers.append({
+            'waves': waves,
+            'interference': surfer.interference,
+            'expected_waves': rate * remaining / 60,
+            'pool': own + prior,
+            'weights': [1.0] * len(own) + [prior_weight] * len(prior)
+        })
+    return {
+        'rule': scoring_rule(data.metadata).spec(),
+        'advancing': advancing_places(snapshot),
+        'wave_cap': data.wave_cap,
+        'surfers': surfers
+    }
+
+class Forecaster:
+    """Runs forecast simulations split across a pool of worker processes.
+    
+    The simulation is pure Python, so threads would take turns on the GIL; each
+    process runs its share of the heat endings and the counts are added up here.
+    The pool starts with the first forecast, like the PDF render pool.
+    """
+    
+    def __init__(self, workers=FORECAST_WORKERS):
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+    
+    def run(self, heat, simulations, seed):
+        """[wins, advances] per surfer over simulations heat endings"""
+        if self.workers <= 1 or simulations < self.workers:
+            return simulate_heat(heat, simulations, f'{seed}:0')
+        shares = [simulations // self.workers + (chunk < simulations % self.workers)
+                  for chunk in range(self.workers)]
+        futures = self._start(heat, shares, seed)
+        tally = [[0, 0] for _ in heat['surfers']]
+        for future in futures:
+            for counts, (wins, advances) in zip(tally, future.result()):
+                counts[0] += wins
+                counts[1] += advances
+        return tally
+    
+    def _start(self, heat, shares, seed):
+        import multiprocessing
+        from concurrent.futures.process import BrokenProcessPool, ProcessPoolExecutor
+        with self._lock:
+            for attempt in range(2):
+                if self._pool is None:
+                    # spawn, not fork: this process runs threads (stream relay, journal writer)
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+                try:
+                    return [self._pool.submit(simulate_heat, heat, share, f'{seed}:{chunk}')
+                            for chunk, share in enumerate(shares)]
+                except BrokenProcessPool:
+                    # A simulation process died; start a fresh pool and retry once
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = None
+            raise BrokenProcessPool('Forecast pool keeps failing')
+    
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+forecaster = Forecaster()
+atexit.register(forecaster.shutdown)
+
+def all_heats():
+    """(heat_id, version, metadata) for every stored or resident heat, by heat id"""
+    stored = {heat_id: (version, metadata) for heat_id, version, metadata in state_store.list_heats()}
+    with heats_lock:
+        for heat_id, heat in heats.items():
+            stored.setdefault(heat_id, (heat.snapshot.version, heat.snapshot.data.metadata))
+    return [(heat_id, version, metadata) for heat_id, (version, metadata) in sorted(stored.items())]
+
+def requested_heat_id():
+    """Heat id from the query string or JSON body; the default heat if not given"""
+    heat_id = request.args.get('heat_id')
+    if heat_id is None and request.is_json:
+        heat_id = (request.get_json(silent=True) or {}).get('heat_id')
+    heat_id = str(heat_id or DEFAULT_HEAT_ID)
+    if len(heat_id) > 64 or not set(heat_id) <= HEAT_ID_CHARS:
+        raise UnknownHeat(heat_id)
+    return heat_id
+
+def requested_version():
+    """expected_version from the query string or JSON body, for compare-and-set
+    writes; None (last write wins) if not given"""
+    version = request.args.get('expected_version')
+    if version is None and request.is_json:
+        version = (request.get_json(silent=True) or {}).get('expected_version')
+    if version is None:
+        return None
+    try:
+        if isinstance(version, (bool, float)):
+            raise ValueError
+        return int(version)
+    except (TypeError, ValueError):
+        raise InvalidOperation('expected_version must be an integer')
+
+@app.errorhandler(UnknownHeat)
+def unknown_heat(error):
+    return jsonify({'error': f'Unknown heat: {error.args[0]}'}), 404
+
+@app.errorhandler(UnknownEvent)
+def unknown_event(error):
+    return jsonify({'error': f'Unknown event: {error.args[0]}'}), 404
+
+@app.errorhandler(VersionConflict)
+def version_conflict(error):
+    # The client re-reads the heat (version is the current one) and retries
+    return jsonify({'error': str(error), 'heat_id': error.heat_id, 'version': error.version}), 409
+
+@app.errorhandler(InvalidOperation)
+def invalid_operation(error):
+    return jsonify({'error': str(error)}), 400
+
+# Bring back heats from the journal (in-memory store) before serving anything.
+# Skipped when a PDF render process re-imports this script as __mp_main__.
+if __name__ != '__mp_main__':
+    if isinstance(state_store, MemoryStateStore):
+        state_store.restore()
+        startup_phase('restore')
+
+asset_versions = {}  # Static filename -> content hash, for cache-busting asset URLs
+
+@app.template_global()
+def asset_url(filename):
+    """URL of a static file with its content hash as ?v=, so the service worker
+    can cache it forever and a changed file is fetched under a new URL"""
+    version = asset_versions.get(filename)
+    if version is None:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            version = asset_versions[filename] = hashlib.sha1(f.read()).hexdigest()[:12]
+    return url_for('static', filename=filename, v=version)
+
+@app.route('/service-worker.js')
+def service_worker():
+    """The service worker, served from the root so its scope covers the whole app"""
+    response = send_from_directory(app.static_folder, 'service-worker.js', max_age=0)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/')
 def index():
-    surfers_with_idx = [(idx, surfer) for idx, surfer in enumerate(current_heat['surfers'])]
+    snapshot = get_heat(requested_heat_id()).snapshot
+    surfers_with_idx = [(idx, surfer) for idx, surfer in enumerate(snapshot.data.surfers)]
+    # ?judge=N (1-based) turns the grid into judge N's score entry for a panel
+    judge = request.args.get('judge', type=int)
+    if judge is not None and not 1 <= judge <= panel_config(snapshot.data.metadata)[0]:
+        judge = None
     return render_template('index.html', 
                          surfers=surfers_with_idx,
-                         metadata=current_heat['metadata'])
+                         metadata=snapshot.data.metadata,
+                         wave_cap=snapshot.data.wave_cap,
+                         heat_id=snapshot.heat_id,
+                         judge=None if judge is None else judge - 1)
+
+@app.route('/heats', methods=['GET'])
+def list_heats():
+    """All stored heats (resident or not) with their metadata"""
+    return jsonify({'heats': [
+        {'heat_id': heat_id, 'version': version, 'metadata': metadata}
+        for heat_id, version, metadata in all_heats()
+    ]})
+
+@app.route('/heats', methods=['POST'])
+def add_heat():
+    """Create a new heat, e.g. for a second peak running in parallel"""
+    data = request.get_json(silent=True) or {}
+    heat_id = str(data.get('heat_id') or uuid.uuid4().hex[:8])
+    if len(heat_id) > 64 or not set(heat_id) <= HEAT_ID_CHARS:
+        return jsonify({'error': 'Heat id may only contain letters, digits, - and _'}), 400
+    
+    surfer_count = data.get('surfer_count', 5)
+    wave_cap = data.get('wave_cap', 20)
+    if not isinstance(surfer_count, int) or not MIN_SURFERS <= surfer_count <= MAX_SURFERS:
+        return jsonify({'error': f'surfer_count must be between {MIN_SURFERS} and {MAX_SURFERS}'}), 400
+    if not isinstance(wave_cap, int) or not 1 <= wave_cap <= MAX_WAVE_CAP:
+        return jsonify({'error': f'wave_cap must be between 1 and {MAX_WAVE_CAP}'}), 400
+    
+    heat = create_heat(heat_id, data.get('metadata'), surfer_count, wave_cap)
+    if heat is None:
+        return jsonify({'error': f'Heat {heat_id} already exists'}), 409
+    snapshot = heat.snapshot
+    return jsonify({'success': True, 'heat_id': heat_id, 'version': snapshot.version,
+                    'metadata': snapshot.data.metadata,
+                    'surfer_count': len(snapshot.data.surfers), 'wave_cap': snapshot.data.wave_cap}), 201
 
 @app.route('/update_metadata', methods=['POST'])
 def update_metadata():
-    data = request.json
-    current_heat['metadata'].update(data)
-    return jsonify({'success': True})
+    data = dict(request.json)
+    data.pop('heat_id', None)
+    expected_version = requested_version()
+    data.pop('expected_version', None)
+    if 'duration' in data:
+        duration = data['duration']
+        if isinstance(duration, bool) or not isinstance(duration, (int, float)) or not 0 < duration < math.inf:
+            return jsonify({'error': 'duration must be a positive number of minutes'}), 400
+    if 'scoring' in data:
+        try:
+            data['scoring'] = parse_scoring(data['scoring'])
+        except ValueError as error:
+            return jsonify({'error': str(error)}), 400
+    snapshot = run_operation(requested_heat_id(), {'op': 'update_metadata', 'metadata': data},
+                             expected_version)
+    return jsonify({'success': True, 'version': snapshot.version})
+
+MAX_EVENT_SURFERS = 1024
+
+@app.route('/events', methods=['GET'])
+def list_events():
+    """Every event bracket: id, category and heats per round"""
+    return jsonify({'events': [
+        {'event_id': event.event_id, 'category': event.category,
+         'rounds': [sum(1 for heat_id in heat_ids if heat_id) for heat_ids in event.rounds]}
+        for event_id, event in sorted(current_events().items())
+    ]})
+
+@app.route('/events', methods=['POST'])
+def add_event():
+    """Build an event bracket: every round's heats, with the seeds (names, best
+    first) in round one. surfers_per_heat 2 is man-on-man."""
+    data = request.get_json(silent=True) or {}
+    event_id = str(data.get('event_id') or uuid.uuid4().hex[:8])
+    if len(event_id) > 48 or not set(event_id) <= HEAT_ID_CHARS:
+        return jsonify({'error': 'Event id may only contain letters, digits, - and _ (48 at most)'}), 400
+    
+    seeds = data.get('surfers')
+    if not isinstance(seeds, list) or not 2 <= len(seeds) <= MAX_EVENT_SURFERS:
+        return jsonify({'error': f'surfers must be a list of 2 to {MAX_EVENT_SURFERS} surfers'}), 400
+    seeds = [seed if isinstance(seed, dict) else {'name': seed} for seed in seeds]
+    if not all(isinstance(seed.get('name'), str) and seed['name'].strip() for seed in seeds):
+        return jsonify({'error': 'Every surfer needs a name'}), 400
+    
+    per_heat = data.get('surfers_per_heat', 4)
+    if not isinstance(per_heat, int) or not MIN_SURFERS <= per_heat <= MAX_SURFERS:
+        return jsonify({'error': f'surfers_per_heat must be between {MIN_SURFERS} and {MAX_SURFERS}'}), 400
+    advancing = data.get('advancing', 1 if per_heat <= 2 else 2)
+    if not isinstance(advancing, int) or not 1 <= advancing <= per_heat // 2:
+        return jsonify({'error': 'advancing must be between 1 and half of surfers_per_heat'}), 400
+    wave_cap = data.get('wave_cap', 20)
+    if not isinstance(wave_cap, int) or not 1 <= wave_cap <= MAX_WAVE_CAP:
+        return jsonify({'error': f'wave_cap must be between 1 and {MAX_WAVE_CAP}'}), 400
+    
+    event = create_event(event_id, [{'name': seed['name'].strip(), 'goal': seed.get('goal') or 0} for seed in seeds],
+                         str(data.get('category') or ''), per_heat, advancing, wave_cap)
+    if event is None:
+        return jsonify({'error': f'Event {event_id} already exists'}), 409
+    return jsonify({'success': True, 'event_id': event_id, 'rounds': event.rounds}), 201
+
+@app.route('/events/<event_id>', methods=['GET'])
+def get_event(event_id):
+    """The whole event: each round's heats, their status, standings and where
+    their qualifiers go. Cached until one of its heats changes."""
+    event = find_event(event_id)
+    # Heat versions only go up, so their sum changes whenever any heat does
+    version = sum(state_store.heat_versions(event.heat_ids()).values())
+    return cached_json(event.payloads, 'view', version, lambda: dict(event_view(event), version=version))
+
+@app.route('/rescore', methods=['POST'])
+def rescore():
+    """Re-score stored heats (all of them, or 'heat_ids') after a rule change or
+    upheld protest; 'scoring' switches them to a new scoring spec first"""
+    data = request.get_json(silent=True) or {}
+    scoring = data.get('scoring')
+    if scoring is not None:
+        try:
+            scoring = parse_scoring(scoring)
+        except ValueError as error:
+            return jsonify({'error': str(error)}), 400
+    
+    stored = [heat_id for heat_id, version, metadata in all_heats()]
+    heat_ids = data.get('heat_ids')
+    if heat_ids is None:
+        heat_ids = stored
+    elif not isinstance(heat_ids, list):
+        return jsonify({'error': 'heat_ids must be a list'}), 400
+    else:
+        known = set(stored)
+        for heat_id in heat_ids:
+            if not isinstance(heat_id, str) or heat_id not in known:
+                raise UnknownHeat(str(heat_id))
+    
+    started = time.perf_counter()
+    results = rescore_heats(heat_ids, scoring)
+    return jsonify({'success': True, 'heats': results,
+                    'changed': sum(result['changed'] for result in results),
+                    'seconds': round(time.perf_counter() - started, 3)})
 
 @app.route('/update_surfers', methods=['POST'])
 def update_surfers():
     data = request.json
-    color_map = {'red': 0, 'yellow': 1, 'black': 2, 'white': 3, 'blue': 4}
-    
-    for color, idx in color_map.items():
-        if color in data:
-            current_heat['surfers'][idx]['name'] = data[color].get('name', '')
-            current_heat['surfers'][idx]['goal'] = data[color].get('goal', 0)
-    
-    return jsonify({'success': True})
+    snapshot = run_operation(requested_heat_id(), {'op': 'update_surfers', 'surfers': data},
+                             requested_version())
+    return jsonify({'success': True, 'version': snapshot.version})
 
 @app.route('/start_timer', methods=['POST'])
 def start_timer():
-    current_heat['metadata']['start_time'] = datetime.now().isoformat()
-    return jsonify({'success': True, 'start_time': current_heat['metadata']['start_time']})
+    start_time = datetime.now().isoformat()
+    snapshot = run_operation(requested_heat_id(), {'op': 'start_timer', 'start_time': start_time},
+                             requested_version())
+    return jsonify({'success': True, 'start_time': start_time, 'version': snapshot.version})
 
 @app.route('/update_score', methods=['POST'])
 def update_score():
     data = request.json
-    surfer_idx = data['surfer_idx']
-    wave_idx = data['wave_idx']
-    score = data['score']
-    
-    if score == '':
-        current_heat['surfers'][surfer_idx]['waves'][wave_idx] = None
-    else:
-        try:
-            score_val = float(score)
-            if 0 <= score_val <= 10:
-                current_heat['surfers'][surfer_idx]['waves'][wave_idx] = score_val
-            else:
-                return jsonify({'error': 'Score must be between 0 and 10'}), 400
-        except ValueError:
-            return jsonify({'error': 'Invalid score'}), 400
+    op = {'op': 'set_score', 'surfer_idx': data.get('surfer_idx'),
+          'wave_idx': data.get('wave_idx'), 'score': data.get('score')}
+    try:
+        snapshot = apply_operations(requested_heat_id(), [op], requested_version())
+    except InvalidOperation as error:
+        return jsonify({'error': str(error)}), 400
     
     # Return live rankings
-    rankings = calculate_rankings()
-    return jsonify({'success': True, 'rankings': rankings})
+    return jsonify({'success': True, 'version': snapshot.version, 'rankings': snapshot.rankings})
+
+@app.route('/update_judge_score', methods=['POST'])
+def update_judge_score():
+    """One panel judge's score for a wave; the wave's official score follows the panel"""
+    data = request.json
+    op = {'op': 'set_judge_score', 'surfer_idx': data.get('surfer_idx'), 'wave_idx': data.get('wave_idx'),
+          'judge': data.get('judge'), 'score': data.get('score')}
+    try:
+        snapshot = apply_operations(requested_heat_id(), [op], requested_version())
+    except InvalidOperation as error:
+        return jsonify({'error': str(error)}), 400
+    
+    return jsonify({'success': True, 'version': snapshot.version,
+                    'wave_score': snapshot.data.surfers[op['surfer_idx']].wave(op['wave_idx']),
+                    'rankings': snapshot.rankings})
 
 @app.route('/toggle_priority', methods=['POST'])
 def toggle_priority():
     data = request.json
-    surfer_idx = data['surfer_idx']
-    
-    # Remove surfer from current position if they're in the order
-    current_priority_order = current_heat['priority_order']
-    if surfer_idx in current_priority_order:
-        current_priority_order.remove(surfer_idx)
-    
-    # Add to end (lowest priority)
-    current_priority_order.append(surfer_idx)
-    
-    # Build response with updated priority order
-    # Include surfers NOT in priority_order as "tied"
-    all_surfers = set(range(5))
-    surfers_in_order = set(current_priority_order)
-    tied_surfers = all_surfers - surfers_in_order
-    
-    priority_display = []
-    
-    # Show tied surfers first
-    if tied_surfers:
-        for idx in sorted(tied_surfers):
-            priority_display.append({
-                'position': 'TIED',
-                'color': current_heat['surfers'][idx]['color'],
-                'idx': idx
-            })
-    
-    # Then show ordered surfers
-    for position, idx in enumerate(current_priority_order, len(tied_surfers) + 1):
-        priority_display.append({
-            'position': position,
-            'color': current_heat['surfers'][idx]['color'],
-            'idx': idx
-        })
-    
-    return jsonify({'success': True, 'priority_order': priority_display})
+    op = {'op': 'toggle_priority', 'surfer_idx': data.get('surfer_idx')}
+    try:
+        snapshot = apply_operations(requested_heat_id(), [op], requested_version())
+    except InvalidOperation as error:
+        return jsonify({'error': str(error)}), 400
+    
+    return jsonify({'success': True, 'version': snapshot.version,
+                    'priority_order': snapshot.priority_order})
 
 @app.route('/toggle_interference', methods=['POST'])
 def toggle_interference():
     data = request.json
-    surfer_idx = data['surfer_idx']
-    
-    # Cycle through: 0 -> 1 -> 2 -> 3 -> 4 -> 5 -> 6 -> 0
-    current_heat['surfers'][surfer_idx]['interference'] = (current_heat['surfers'][surfer_idx]['interference'] + 1) % 7
-    
-    rankings = calculate_rankings()
+    surfer_idx = data.get('surfer_idx')
+    op = {'op': 'toggle_interference', 'surfer_idx': surfer_idx}
+    try:
+        snapshot = apply_operations(requested_heat_id(), [op], requested_version())
+    except InvalidOperation as error:
+        return jsonify({'error': str(error)}), 400
+    
+    interference = snapshot.data.surfers[surfer_idx].interference
     return jsonify({'success': True, 
-                   'interference': current_heat['surfers'][surfer_idx]['interference'],
-                   'rankings': rankings})
+                   'version': snapshot.version,
+                   'interference': interference,
+                   'rankings': snapshot.rankings})
 
 @app.route('/mark_interference_wave', methods=['POST'])
 def mark_interference_wave():
     """Mark/unmark a specific wave with interference triangle (ISA visual marking)"""
     data = request.json
-    surfer_idx = data['surfer_idx']
-    wave_idx = data['wave_idx']
-    
-    interference_waves = current_heat['surfers'][surfer_idx]['interference_waves']
-    
-    if wave_idx in interference_waves:
-        # Unmark
-        interference_waves.remove(wave_idx)
-    else:
-        # Mark with triangle
-        interference_waves.append(wave_idx)
-    
+    surfer_idx = data.get('surfer_idx')
+    op = {'op': 'mark_interference_wave', 'surfer_idx': surfer_idx, 'wave_idx': data.get('wave_idx')}
+    try:
+        snapshot = apply_operations(requested_heat_id(), [op], requested_version())
+    except InvalidOperation as error:
+        return jsonify({'error': str(error)}), 400
+    
+    interference_waves = list(snapshot.data.surfers[surfer_idx].interference_waves)
     return jsonify({
         'success': True,
+        'version': snapshot.version,
         'interference_waves': interference_waves
     })
 
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Apply a list of operations atomically (offline replay, heat imports).
+    
+    Body: {"operations": [{"op": "set_score", "surfer_idx": 0, "wave_idx": 3, "score": 7.5},
+                          {"op": "toggle_interference", "surfer_idx": 2}, ...],
+           "expected_version": 41}
+    Operations: set_score (score '' or null clears), set_interference (interference 0-6),
+    toggle_interference, mark_interference_wave (optional marked true/false) and
+    toggle_priority. Nothing is applied unless every operation is valid, and, when
+    expected_version is given, unless the heat is still at that version (else 409).
+    """
+    data = request.get_json(silent=True) or {}
+    ops = data.get('operations')
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'error': 'operations must be a non-empty list'}), 400
+    
+    try:
+        snapshot = apply_operations(requested_heat_id(), ops, requested_version())
+    except InvalidOperation as error:
+        return jsonify({'error': str(error), 'index': error.index}), 400
+    
+    return jsonify({
+        'success': True,
+        'applied': len(ops),
+        'version': snapshot.version,
+        'rankings': snapshot.rankings,
+        'priority_order': snapshot.priority_order
+    })
+
+# Leaderboard entry fields, in the order the binary encoding writes them
+RANKING_FIELDS = ('idx', 'color', 'position', 'total', 'top_waves', 'all_waves_sorted',
+                  'all_waves', 'interference', 'needs')
+RANKINGS_MIMETYPE = 'application/x-surf-rankings'
+RANKINGS_MAGIC = b'SJR2'  # Format 2: totals widened to uint32 (best_waves goes up to MAX_WAVE_CAP)
+RANKINGS_HEADER = struct.Struct('<4sIIHB')  # magic, version, since, field mask, entry count
+RANKINGS_NEED = struct.Struct('<BHH')  # place, wave, combo
+NO_SCORE = 0xFFFF  # A null score (e.g. a need that cannot be reached)
+FULL_RANKINGS = 0xFFFFFFFF  # "since" of a response that is not a delta
+STALE_SINCE = -1  # What a since that is no longer remembered is served as
+
+def requested_fields():
+    """?fields= as a tuple in RANKING_FIELDS order (idx is always included), or None for all"""
+    value = request.args.get('fields')
+    if not value:
+        return None
+    fields = set(value.split(','))
+    unknown = fields - set(RANKING_FIELDS)
+    if unknown:
+        raise InvalidOperation(f'Unknown ranking field: {sorted(unknown)[0]}')
+    fields.add('idx')
+    return tuple(field for field in RANKING_FIELDS if field in fields)
+
+def requested_since():
+    """?since=<version> for a delta, or None"""
+    value = request.args.get('since')
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidOperation('since must be a heat version')
+
+def rankings_view(heat, snapshot, fields=None, since=None):
+    """The rankings response: entries cut down to fields, and when since is a
+    version this process still remembers, only the entries that changed after it.
+    
+    A delta has 'delta': true, the changed entries and 'order' (every surfer's
+    idx in leaderboard order). When since is too old the full leaderboard is sent
+    with 'delta': false, so clients can always just merge by idx.
+    """
+    def project(entries):
+        if fields is None:
+            return entries
+        return [{field: entry[field] for field in fields} for entry in entries]
+    
+    view = {'version': snapshot.version}
+    if since is not None:
+        past = heat.rankings_at(since) if since <= snapshot.version else None
+        view['delta'] = past is not None
+        if past is not None:
+            before = {entry['idx']: entry for entry in project(past)}
+            view['since'] = since
+            view['order'] = [entry['idx'] for entry in snapshot.rankings]
+            view['rankings'] = [entry for entry in project(snapshot.rankings) if before.get(entry['idx']) != entry]
+            return view
+    view['rankings'] = project(snapshot.rankings)
+    return view
+
+def _milli(score):
+    return NO_SCORE if score is None else int(round(score * 1000))
+
+def pack_rankings(view, fields=None):
+    """Binary encoding of a rankings view, little-endian:
+    
+    header: 4s magic b'SJR2', uint32 version, uint32 since (0xFFFFFFFF when not
+    a delta), uint16 field mask (bit i = RANKING_FIELDS[i]), uint8 entry count;
+    then uint8 n and n x uint8 'order' (n is 0 when not a delta); then for each
+    entry its fields in RANKING_FIELDS order: idx, position and interference as
+    uint8, color as a uint8 index into JERSEY_COLORS, total as uint32
+    thousandths, other scores (waves, needs) as uint16 thousandths (0xFFFF =
+    null), wave lists as uint8 n + n scores, and needs as uint8 n + n x (uint8
+    place, score wave, score combo).
+    """
+    fields = fields or RANKING_FIELDS
+    entries = view['rankings']
+    order = view.get('order', [])
+    mask = sum(1 << RANKING_FIELDS.index(field) for field in fields)
+    since = view['since'] if view.get('delta') else FULL_RANKINGS
+    parts = [RANKINGS_HEADER.pack(RANKINGS_MAGIC, view['version'], since, mask, len(entries)),
+             bytes([len(order)] + order)]
+    for entry in entries:
+        for field in fields:
+            value = entry[field]
+            if field in ('idx', 'position', 'interference'):
+                parts.append(bytes((value,)))
+            elif field == 'color':
+                parts.append(bytes((JERSEY_COLORS.index(value),)))
+            elif field == 'total':
+                parts.append(struct.pack('<I', int(round(value * 1000))))
+            elif field == 'needs':
+                parts.append(bytes((len(value),)))
+                parts += [RANKINGS_NEED.pack(need['place'], _milli(need['wave']), _milli(need['combo']))
+                          for need in value]
+            else:
+                parts.append(struct.pack(f'<B{len(value)}H', len(value), *map(_milli, value)))
+    return b''.join(parts)
+
+# Reads serve the heat's current snapshot and never wait for a writer
+
 @app.route('/get_rankings', methods=['GET'])
 def get_rankings():
-    rankings = calculate_rankings()
-    return jsonify({'rankings': rankings})
+    """The leaderboard. Optional: ?fields=idx,total,... for just those fields,
+    ?since=<version> for only what changed after it, ?format=binary for the
+    pack_rankings encoding instead of JSON."""
+    heat = get_heat(requested_heat_id())
+    snapshot = heat.snapshot
+    fields = requested_fields()
+    since = requested_since()
+    if since is not None and (since > snapshot.version or heat.rankings_at(since) is None):
+        # Too old (or unknown): every such client gets the same full response,
+        # so arbitrary since values do not each cache a body
+        since = STALE_SINCE
+    encoding = request.args.get('format', 'json')
+    if encoding not in ('json', 'binary'):
+        raise InvalidOperation('format must be json or binary')
+    
+    name = 'rankings' if fields is None and since is None else f"rankings:{','.join(fields or ())}:{since}"
+    if encoding == 'binary':
+        return cached_body(snapshot.payloads, name + ':binary', snapshot.version,
+                           lambda: pack_rankings(rankings_view(heat, snapshot, fields, since), fields),
+                           RANKINGS_MIMETYPE)
+    return cached_json(snapshot.payloads, name, snapshot.version,
+                       lambda: rankings_view(heat, snapshot, fields, since))
 
 @app.route('/get_priority_order', methods=['GET'])
 def get_priority_order():
-    all_surfers = set(range(5))
-    surfers_in_order = set(current_heat['priority_order'])
-    tied_surfers = all_surfers - surfers_in_order
-    
-    priority_display = []
-    
-    if tied_surfers:
-        for idx in sorted(tied_surfers):
-            priority_display.append({
-                'position': 'TIED',
-                'color': current_heat['surfers'][idx]['color'],
-                'idx': idx
-            })
-    
-    for position, idx in enumerate(current_heat['priority_order'], len(tied_surfers) + 1):
-        priority_display.append({
-            'position': position,
-            'color': current_heat['surfers'][idx]['color'],
-            'idx': idx
-        })
-    
-    return jsonify({'priority_order': priority_display})
+    snapshot = get_heat(requested_heat_id()).snapshot
+    return cached_json(snapshot.payloads, 'priority_order', snapshot.version,
+                       lambda: {'priority_order': snapshot.priority_order, 'version': snapshot.version})
+
+@app.route('/get_needs', methods=['GET'])
+def get_needs():
+    """What each surfer needs to reach 1st and the advancing places"""
+    snapshot = get_heat(requested_heat_id()).snapshot
+    return cached_json(snapshot.payloads, 'needs', snapshot.version,
+                       lambda: {'advancing': advancing_places(snapshot),
+                                'needs': calculate_needs(snapshot.rankings),
+                                'version': snapshot.version})
+
+@app.route('/get_rankings_at', methods=['GET'])
+def get_rankings_at():
+    """The leaderboard as of t seconds into the heat (?t=), replayed from the event log"""
+    t = request.args.get('t', type=float)
+    if t is None or not t >= 0:
+        return jsonify({'error': 't must be a number of seconds from the heat start'}), 400
+    snapshot = get_heat(requested_heat_id()).snapshot
+    rankings, events = heat_timeline(snapshot).rankings_at(t, advancing_places(snapshot))
+    return jsonify({'t': t, 'rankings': rankings, 'events': events, 'version': snapshot.version})
+
+@app.route('/get_timeline', methods=['GET'])
+def get_timeline():
+    """Every score and interference change in time order, with the lead changes"""
+    snapshot = get_heat(requested_heat_id()).snapshot
+    
+    def build():
+        timeline = heat_timeline(snapshot)
+        surfers = snapshot.data.surfers
+        return {
+            'start_time': snapshot.data.metadata.get('start_time'),
+            'events': [
+                {'t': t, 'kind': kind, 'idx': surfer_idx, 'color': surfers[surfer_idx].color,
+                 'wave_idx': wave_idx, 'value': value}
+                for t, kind, surfer_idx, wave_idx, value in timeline.events
+            ],
+            'lead_changes': timeline.lead_changes,
+            'version': snapshot.version
+        }
+    return cached_json(snapshot.payloads, 'timeline', snapshot.version, build)
+
+@app.route('/get_panel', methods=['GET'])
+def get_panel():
+    """Every judge's score per wave, next to the official wave scores"""
+    snapshot = get_heat(requested_heat_id()).snapshot
+    
+    def build():
+        judges, aggregation = panel_config(snapshot.data.metadata)
+        return {
+            'judges': judges,
+            'aggregation': aggregation,
+            'surfers': [
+                {'idx': idx, 'color': surfer.color,
+                 'waves': [surfer.wave(wave_idx) for wave_idx in range(len(surfer.waves))],
+                 'panel': [[surfer.judge_score(wave_idx, judge) for judge in range(judges)]
+                           for wave_idx in range(len(surfer.waves))]}
+                for idx, surfer in enumerate(snapshot.data.surfers)
+            ],
+            'version': snapshot.version
+        }
+    return cached_json(snapshot.payloads, 'panel', snapshot.version, build)
+
+@app.route('/get_forecast', methods=['GET'])
+def get_forecast():
+    """Each surfer's chance to win and to advance, from ?simulations= simulated
+    endings of the heat (see forecast.py)"""
+    requested = request.args.get('simulations', type=int) if 'simulations' in request.args else FORECAST_SIMULATIONS[1]
+    if requested is None or requested < 1:
+        return jsonify({'error': 'simulations must be a positive number'}), 400
+    # Rounded up to one of a few sizes (capped at the largest), so clients
+    # asking for arbitrary counts share runs and cached results
+    simulations = next((size for size in FORECAST_SIMULATIONS if size >= requested), FORECAST_SIMULATIONS[-1])
+    snapshot = get_heat(requested_heat_id()).snapshot
+    # Round the clock up to a FORECAST_STEP, so polls within a step share one run
+    remaining = math.ceil(heat_remaining(snapshot.data.metadata) / FORECAST_STEP) * FORECAST_STEP
+    
+    def build():
+        started = time.perf_counter()
+        heat = forecast_input(snapshot, remaining)
+        # Seeded by version and clock, so every app worker forecasts the same chances
+        tally = forecaster.run(heat, simulations, f'{snapshot.heat_id}:{snapshot.version}:{remaining}')
+        return {
+            'simulations': simulations,
+            'remaining_seconds': remaining,
+            'advancing': heat['advancing'],
+            'forecast': [
+                {'idx': idx, 'color': surfer.color, 'name': surfer.name,
+                 'win': wins / simulations, 'advance': advances / simulations,
+                 'expected_waves': round(heat['surfers'][idx]['expected_waves'], 2)}
+                for idx, (surfer, (wins, advances)) in enumerate(zip(snapshot.data.surfers, tally))
+            ],
+            'seconds': round(time.perf_counter() - started, 4),
+            'version': snapshot.version
+        }
+    return cached_json(snapshot.payloads, f'forecast:{simulations}',
+                       (snapshot.version, remaining, state_store.tracker_version()), build)
+
+# Each /stream client holds a worker thread for as long as it is connected, so
+# only this many per worker may, leaving the other threads for judges and polls
+STREAM_CLIENTS = int(os.environ.get('SURF_JUDGE_STREAM_CLIENTS', '40'))
+STREAM_RETRY_AFTER = 15  # Seconds a refused client waits before trying again
+stream_slots = threading.BoundedSemaphore(STREAM_CLIENTS)
+
+@app.route('/stream', methods=['GET'])
+def stream():
+    """Server-Sent Events stream of ranking, priority and heat/interference changes"""
+    heat = get_heat(requested_heat_id())
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    if not stream_slots.acquire(blocking=False):
+        return (jsonify({'error': 'Too many live connections, poll /get_rankings instead'}), 503,
+                {'Retry-After': str(STREAM_RETRY_AFTER)})
+    response = Response(
+        heat.feed.subscribe(last_event_id),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Keep reverse proxies from buffering the stream
+        }
+    )
+    # Runs when the client disconnects, or when a response that never started is dropped
+    response.call_on_close(stream_slots.release)
+    return response
 
 @app.route('/close_heat', methods=['POST'])
 def close_heat():
-    current_heat['metadata']['is_closed'] = True
-    results = calculate_rankings()
-    
-    # Add scores to session tracker
-    for surfer in current_heat['surfers']:
-        name = surfer.get('name', '').strip()
-        goal = surfer.get('goal', 0)
-        
-        if name:  # Only track if name is provided
-            if name not in session_tracker:
-                session_tracker[name] = {
-                    'heats': [],
-                    'goal': goal
-                }
-            
-            # Find this surfer's score in results
-            for result in results:
-                if result['color'] == surfer['color']:
-                    session_tracker[name]['heats'].append(result['total'])
-                    break
-    
-    return jsonify({'results': results})
+    snapshot = run_operation(requested_heat_id(), {'op': 'close_heat', 'closed_at': datetime.now().isoformat()},
+                             requested_version())
+    response = {'results': snapshot.rankings, 'version': snapshot.version}
+    if snapshot.data.metadata.get('bracket'):
+        response['advanced'] = advance_bracket(snapshot)
+    return jsonify(response)
+
+def session_tracker_view():
+    """The whole tracker: each athlete's aggregates plus every heat total, in name order"""
+    return {'tracker': {
+        athlete['name']: dict(athlete, heats=[total for _, total in heats],
+                              heat_ids=[heat_id for heat_id, _ in heats])
+        for athlete, heats in state_store.iter_totals()
+    }}
 
 @app.route('/get_session_tracker', methods=['GET'])
 def get_session_tracker():
-    return jsonify({'tracker': session_tracker})
+    return cached_json(tracker_payloads, 'tracker', state_store.tracker_version(), session_tracker_view)
+
+MAX_PAGE_SIZE = 200
+
+def requested_page(default_limit=50):
+    """(offset, limit) from the query string; ValueError if out of range"""
+    offset = int(request.args.get('offset', 0))
+    limit = int(request.args.get('limit', default_limit))
+    if offset < 0 or not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'offset must be >= 0 and limit between 1 and {MAX_PAGE_SIZE}')
+    return offset, limit
+
+@app.route('/athletes', methods=['GET'])
+def list_athletes():
+    """A page of athletes with their aggregates.
+    
+    ?q= filters by name, ?status= by goal status; ?sort= is one of ATHLETE_SORTS
+    and ?order= asc or desc; ?offset= and ?limit= pick the page.
+    """
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc')
+    try:
+        offset, limit = requested_page()
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    if sort not in ATHLETE_SORTS or order not in ('asc', 'desc'):
+        return jsonify({'error': f"sort must be one of {', '.join(ATHLETE_SORTS)} and order asc or desc"}), 400
+    
+    total, athletes = state_store.query_athletes(request.args.get('q', ''), request.args.get('status') or None,
+                                                 sort, order == 'desc', offset, limit)
+    return jsonify({'total': total, 'offset': offset, 'limit': limit, 'athletes': athletes})
+
+@app.route('/athletes/<path:name>/heats', methods=['GET'])
+def athlete_heats(name):
+    """An athlete's aggregates and a page of their heat history, oldest first"""
+    try:
+        offset, limit = requested_page()
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    athlete = state_store.athlete(name)
+    if athlete is None:
+        return jsonify({'error': f'Unknown athlete: {name}'}), 404
+    return jsonify({'athlete': athlete, 'total': athlete['heat_count'], 'offset': offset, 'limit': limit,
+                    'heats': state_store.athlete_history(name, offset, limit)})
 
 @app.route('/reopen_heat', methods=['POST'])
 def reopen_heat():
-    current_heat['metadata']['is_closed'] = False
-    return jsonify({'success': True})
+    snapshot = run_operation(requested_heat_id(), {'op': 'reopen_heat'}, requested_version())
+    return jsonify({'success': True, 'version': snapshot.version})
 
 @app.route('/reset_heat', methods=['POST'])
 def reset_heat():
-    for surfer in current_heat['surfers']:
-        surfer['waves'] = [None] * 20
-        surfer['interference'] = 0
-        surfer['interference_waves'] = []
-    current_heat['metadata']['start_time'] = None
-    current_heat['metadata']['is_closed'] = False
-    current_heat['metadata']['notes'] = ''
-    current_heat['priority_order'] = []  # Reset to no priority
-    return jsonify({'success': True})
+    snapshot = run_operation(requested_heat_id(), {'op': 'reset_heat'}, requested_version())
+    return jsonify({'success': True, 'version': snapshot.version})
 
-@app.route('/export_csv', methods=['GET'])
-def export_csv():
-    results = calculate_rankings()
-    
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
+def heat_csv_rows(data, results):
+    """Rows of a heat's CSV export: metadata, full scoring grid and final results"""
     # Metadata header
-    writer.writerow(['Heat Number', current_heat['metadata']['heat_number']])
-    writer.writerow(['Category', current_heat['metadata']['category']])
-    writer.writerow(['Round', current_heat['metadata']['round']])
-    writer.writerow(['Location', current_heat['metadata']['location']])
-    writer.writerow(['Duration', f"{current_heat['metadata']['duration']} minutes"])
-    if current_heat['metadata']['notes']:
-        writer.writerow(['Notes', current_heat['metadata']['notes']])
-    writer.writerow([])  # Empty row
+    yield ['Heat Number', data.metadata['heat_number']]
+    yield ['Category', data.metadata['category']]
+    yield ['Round', data.metadata['round']]
+    yield ['Location', data.metadata['location']]
+    yield ['Duration', f"{data.metadata['duration']} minutes"]
+    if data.metadata['notes']:
+        yield ['Notes', data.metadata['notes']]
+    yield []  # Empty row
     
     # Full scoring grid
-    writer.writerow(['FULL SCORING GRID'])
-    grid_header = ['Surfer'] + [f'W{i+1}' for i in range(20)]
-    writer.writerow(grid_header)
+    yield ['FULL SCORING GRID']
+    yield ['Surfer'] + [f'W{i+1}' for i in range(data.wave_cap)]
     
-    for surfer in current_heat['surfers']:
-        row = [surfer['color']]
-        for wave in surfer['waves']:
-            row.append(f"{wave:.2f}" if wave is not None else '-')
-        writer.writerow(row)
+    for surfer in data.surfers:
+        row = [surfer.color]
+        for wave in surfer.waves:
+            row.append(f"{wave:.2f}" if wave == wave else '-')
+        yield row
     
-    writer.writerow([])  # Empty row
+    yield []  # Empty row
     
     # Final results
-    writer.writerow(['FINAL RESULTS'])
-    writer.writerow(['Position', 'Surfer', 'Best Wave', '2nd Wave', 'Total', 'Interference'])
+    yield ['FINAL RESULTS']
+    yield ['Position', 'Surfer', 'Best Wave', '2nd Wave', 'Total', 'Interference']
     
     # Data
     interference_labels = {
@@ -364,228 +3062,524 @@ def export_csv():
     for result in results:
         waves = result['top_waves'] + [None] * (2 - len(result['top_waves']))
         interference_label = interference_labels.get(result['interference'], 'None')
-        writer.writerow([
+        yield [
             result['position'],
             result['color'],
             f"{waves[0]:.2f}" if waves[0] is not None else '-',
             f"{waves[1]:.2f}" if waves[1] is not None else '-',
             f"{result['total']:.2f}",
             interference_label
-        ])
-    
-    # Prepare file for download
-    output.seek(0)
-    
-    # Create filename: category_heatnumber (e.g., "OpenMen_H1")
-    category_clean = current_heat['metadata']['category'].replace(' ', '') if current_heat['metadata']['category'] else 'Category'
-    heat_clean = current_heat['metadata']['heat_number'].replace(' ', '') if current_heat['metadata']['heat_number'] else 'Heat'
-    filename = f"{category_clean}_H{heat_clean}.csv"
-    
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=filename
-    )
+        ]
 
-@app.route('/export_session_csv', methods=['GET'])
-def export_session_csv():
-    # Create CSV in memory
+def csv_bytes(rows):
+    """Encode rows as one chunk of CSV"""
     output = io.StringIO()
-    writer = csv.writer(output)
+    csv.writer(output).writerows(rows)
+    return output.getvalue().encode('utf-8')
+
+def read_heat_results(heat_id, build):
+    """build(data, rankings) for one heat, read consistently and without making the
+    heat resident; None if the heat no longer exists"""
+    if not state_store.shared:
+        with heats_lock:
+            heat = heats.get(heat_id)
+            if heat is None:
+                # The in-memory store hands out the live Heat; holding heats_lock
+                # keeps anyone from loading (and scoring) it while it is read
+                version, data = state_store.read_heat(heat_id)
+                if data is None:
+                    return None
+                return build(data, heat_engine(data).rankings())
+        snapshot = heat.snapshot
+        return build(snapshot.data, snapshot.rankings)
+    
+    # SQLite: every write is stored, so the store is the freshest copy
+    version, data = state_store.read_heat(heat_id)
+    if data is None:
+        return None
+    return build(data, heat_engine(data).rankings())
+
+def heat_export_rows(heat_id):
+    """One heat's CSV rows, or None if the heat no longer exists.
     
-    # Header
-    writer.writerow(['SESSION PERFORMANCE TRACKER'])
-    writer.writerow(['Generated:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
-    writer.writerow([])
+    Only one heat's rows are held at a time, which is what keeps the event
+    exports' memory flat.
+    """
+    return read_heat_results(heat_id, lambda data, rankings: list(heat_csv_rows(data, rankings)))
+
+# Event brackets: round-by-round heats whose results seed the next round. The
+# heats are the source of truth; each bracket heat's metadata carries its
+# event_id and 'bracket': {'round', 'heat', 'advance_to': [[heat_id, slot], ...]}
+# (where its 1st, 2nd, ... place surfers go next).
+
+class EventBracket:
+    """An event's heats by round (heat ids, None for a bye), plus its cached full-event view"""
+    
+    __slots__ = ('event_id', 'category', 'rounds', 'payloads')
+    
+    def __init__(self, event_id, category=''):
+        self.event_id = event_id
+        self.category = category
+        self.rounds = []  # [[heat_id, ...], ...]
+        self.payloads = {}
+    
+    def heat_ids(self):
+        return [heat_id for heat_ids in self.rounds for heat_id in heat_ids if heat_id]
+    
+    def place(self, heat_id, round_idx, heat_idx):
+        while len(self.rounds) <= round_idx:
+            self.rounds.append([])
+        heat_ids = self.rounds[round_idx]
+        while len(heat_ids) <= heat_idx:
+            heat_ids.append(None)
+        heat_ids[heat_idx] = heat_id
+
+# event_id -> EventBracket. Brackets never change shape once created, so
+# the index only grows; it is rescanned from the stored heats when the number
+# of heats changes or an event id is unknown, which picks up events created
+# by other workers.
+events = {}
+events_lock = threading.Lock()
+events_indexed = -1  # Stored heat count at the last scan
+
+def index_events():
+    global events_indexed
+    count = state_store.heat_count()
+    found = {}
+    for heat_id, version, metadata in all_heats():
+        bracket = metadata.get('bracket')
+        if bracket and metadata.get('event_id'):
+            event = found.get(metadata['event_id'])
+            if event is None:
+                event = found[metadata['event_id']] = EventBracket(metadata['event_id'], metadata.get('category', ''))
+            event.place(heat_id, bracket['round'], bracket['heat'])
+            for round_idx, heat_idx in bracket.get('byes', ()):
+                event.place(None, round_idx, heat_idx)
+    with events_lock:
+        for event_id, event in found.items():
+            events.setdefault(event_id, event)
+        events_indexed = count
+
+def current_events():
+    """The event index, rescanned only if heats were added since the last scan"""
+    if state_store.heat_count() != events_indexed:
+        index_events()
+    return events
+
+def find_event(event_id):
+    event = events.get(event_id)
+    if event is None:
+        index_events()
+        event = events.get(event_id)
+        if event is None:
+            raise UnknownEvent(event_id)
+    return event
+
+def round_name(round_idx, round_count):
+    from_final = round_count - 1 - round_idx
+    if from_final < 3:
+        return ('Final', 'Semifinal', 'Quarterfinal')[from_final]
+    return f'Round {round_idx + 1}'
+
+def bracket_layout(entrants, per_heat, advancing):
+    """Surfers per heat, round by round, down to a single final. Heats in a round
+    are as even as possible, smaller ones first (so the top seeds get any byes);
+    the top advancing of each go through."""
+    rounds = []
+    while True:
+        heat_count = -(-entrants // per_heat)
+        rounds.append([entrants // heat_count + (heat >= heat_count - entrants % heat_count)
+                       for heat in range(heat_count)])
+        if heat_count == 1:
+            return rounds
+        entrants = sum(min(advancing, size) for size in rounds[-1])
+
+def create_event(event_id, seeds, category='', per_heat=4, advancing=None, wave_cap=20):
+    """Create every heat of a bracket for seeds (names, best seed first) and put the
+    seeds into round one. Returns the EventBracket, or None if a heat id is taken.
+    
+    Round one is snake-seeded (1-2-3-4 across the heats, then back 4-3-2-1) so the
+    top seeds meet as late as possible. Later rounds take the qualifiers heat by
+    heat, so the winners of heats 1 and 2 meet in the next heat 1. A heat that
+    would eliminate nobody (no more surfers than advance, e.g. the odd one out
+    man-on-man) is a bye: it is not created, and its surfers go straight to the
+    next round.
+    """
+    if advancing is None:
+        advancing = 1 if per_heat <= 2 else 2
+    layout = bracket_layout(len(seeds), per_heat, advancing)
+    last = len(layout) - 1
+    heat_ids = [[None if round_idx < last and size <= advancing else f'{event_id}-r{round_idx + 1}-h{heat_idx + 1}'
+                 for heat_idx, size in enumerate(sizes)]
+                for round_idx, sizes in enumerate(layout)]
+    if state_store.heat_versions(heat_id for ids in heat_ids for heat_id in ids if heat_id):
+        return None
+    
+    # Round one: snake seeding, passing over heats that are already full
+    first_round = [[] for _ in layout[0]]
+    snake = list(range(len(first_round)))
+    entrants = iter(seeds)
+    while any(len(heat) < size for heat, size in zip(first_round, layout[0])):
+        for heat_idx in snake:
+            if len(first_round[heat_idx]) < layout[0][heat_idx]:
+                first_round[heat_idx].append(next(entrants))
+        snake.reverse()
+    
+    # Follow every surfer's place through the rounds. Each heat's line-up is a
+    # list of sources: a seed (a dict), or (heat_id, place) for whoever finishes
+    # there. Qualifiers fill the next round's heats in order; a bye passes its
+    # line-up on as it is.
+    lineups = first_round
+    advance_to = {}  # heat_id -> [[next heat_id, slot], ...] by place
+    seeded = {}  # heat_id -> {slot: seed}
+    for round_idx, sizes in enumerate(layout):
+        qualifiers = []
+        for heat_idx, lineup in enumerate(lineups):
+            heat_id = heat_ids[round_idx][heat_idx]
+            if heat_id is None:
+                qualifiers += lineup
+                continue
+            for slot, source in enumerate(lineup):
+                if isinstance(source, dict):
+                    seeded.setdefault(heat_id, {})[slot] = source
+                else:
+                    advance_to.setdefault(source[0], []).append((source[1], [heat_id, slot]))
+            qualifiers += [(heat_id, place) for place in range(min(advancing, len(lineup)))]
+        if round_idx < last:
+            qualifiers = iter(qualifiers)
+            lineups = [[next(qualifiers) for _ in range(size)] for size in layout[round_idx + 1]]
+    
+    byes = [[round_idx, heat_idx] for round_idx, ids in enumerate(heat_ids)
+            for heat_idx, heat_id in enumerate(ids) if heat_id is None]
+    event = EventBracket(event_id, category)
+    for round_idx, sizes in enumerate(layout):
+        for heat_idx, size in enumerate(sizes):
+            heat_id = heat_ids[round_idx][heat_idx]
+            event.place(heat_id, round_idx, heat_idx)
+            if heat_id is None:
+                continue
+            bracket = {'round': round_idx, 'heat': heat_idx,
+                       'advance_to': [target for place, target in sorted(advance_to.get(heat_id, []))]}
+            if round_idx == last and byes:
+                bracket['byes'] = byes  # So the bracket can be rebuilt from the stored heats
+            metadata = {
+                'category': category,
+                'round': round_name(round_idx, len(layout)),
+                'heat_number': str(heat_idx + 1),
+                'event_id': event_id,
+                'bracket': bracket
+            }
+            if round_idx < last:
+                metadata['advancing'] = advancing
+            if create_heat(heat_id, metadata, max(size, MIN_SURFERS), wave_cap) is None:
+                return None
+    for heat_id, slots in seeded.items():
+        run_operation(heat_id, {'op': 'update_surfers', 'surfers': {
+            JERSEY_COLORS[slot].lower(): {'name': entrant['name'], 'goal': entrant.get('goal', 0)}
+            for slot, entrant in slots.items()
+        }})
+    with events_lock:
+        events[event_id] = event
+    return event
+
+def advance_bracket(snapshot):
+    """Put a closed bracket heat's qualifiers into their next-round heats.
+    
+    Safe to repeat: a heat re-closed after a protest or re-scored moves the new
+    qualifiers in. Heats that have already started are left alone. Returns the
+    seeding done, one {'heat_id', 'slot', 'name'} or {'heat_id', 'skipped'} per place.
+    """
+    metadata = snapshot.data.metadata
+    bracket = metadata.get('bracket')
+    if not bracket or not metadata.get('is_closed'):
+        return []
+    seeded = []
+    for result, (heat_id, slot) in zip(snapshot.rankings, bracket['advance_to']):
+        target = get_heat(heat_id).snapshot
+        if target.data.metadata.get('start_time') or target.data.log:
+            seeded.append({'heat_id': heat_id, 'skipped': 'already started'})
+            continue
+        surfer = snapshot.data.surfers[result['idx']]
+        current = target.data.surfers[slot]
+        if (current.name, current.goal) != (surfer.name, surfer.goal):
+            run_operation(heat_id, {'op': 'update_surfers', 'surfers': {
+                current.color.lower(): {'name': surfer.name, 'goal': surfer.goal}}})
+        seeded.append({'heat_id': heat_id, 'slot': slot, 'name': surfer.name})
+    return seeded
+
+def event_view(event):
+    """Every round's heats with their status and standings"""
+    def heat_summary(data, rankings):
+        metadata = data.metadata
+        status = 'closed' if metadata.get('is_closed') else 'live' if metadata.get('start_time') else 'upcoming'
+        return {
+            'heat_number': metadata.get('heat_number'),
+            'status': status,
+            'surfers': [{'color': result['color'], 'name': data.surfers[result['idx']].name,
+                         'position': result['position'], 'total': result['total']} for result in rankings],
+            'advance_to': metadata.get('bracket', {}).get('advance_to', [])
+        }
+    
+    rounds = []
+    for round_idx, heat_ids in enumerate(event.rounds):
+        rounds.append({
+            'name': round_name(round_idx, len(event.rounds)),
+            'heats': [dict(read_heat_results(heat_id, heat_summary) or {}, heat_id=heat_id) if heat_id
+                      else {'heat_id': None, 'bye': True} for heat_id in heat_ids]
+        })
+    return {'event_id': event.event_id, 'category': event.category, 'rounds': rounds}
+
+class StreamSink:
+    """Write-only file object whose contents are drained chunk by chunk into a response"""
     
-    # Column headers
-    writer.writerow(['Surfer Name', 'Heat 1', 'Heat 2', 'Heat 3', 'Heat 4', 'Heat 5', 'Heat 6', 'Average', 'Goal Score', 'Best Score', 'Status'])
+    def __init__(self):
+        self._chunks = []
     
-    # Data rows
-    for name, info in session_tracker.items():
-        heats = info.get('heats', [])
-        goal = info.get('goal', 0)
-        
-        # Pad heats to 6 columns
-        heat_scores = []
-        for i in range(6):
-            if i < len(heats) and heats[i] is not None:
-                heat_scores.append(f"{heats[i]:.2f}")
-            else:
-                heat_scores.append('-')
-        
-        # Calculate best score, average, and status
-        valid_heats = [h for h in heats if h is not None]
-        best_score = max(valid_heats) if valid_heats else 0
-        avg_score = sum(valid_heats) / len(valid_heats) if valid_heats else 0
-        
-        if best_score >= goal and goal > 0:
-            if best_score > goal:
-                status = 'Above Goal'
-            else:
-                status = 'Goal Hit!'
-        elif goal > 0:
-            status = 'In Progress'
-        else:
-            status = '-'
-        
-        # Write row
-        row = [name] + heat_scores + [f"{avg_score:.2f}" if avg_score > 0 else '-', f"{goal:.1f}" if goal > 0 else '-', f"{best_score:.2f}" if best_score > 0 else '-', status]
-        writer.writerow(row)
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
     
-    # Prepare file for download
-    output.seek(0)
+    def flush(self):
+        pass
     
-    # Create filename with timestamp
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"KSS_Session_{timestamp}.csv"
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def measured_export(chunks, export_format, route):
+    """Pass a stream's chunks through, recording its export time and size at the end"""
+    started = time.perf_counter()
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        EXPORT_SECONDS.observe(time.perf_counter() - started, export_format)
+        RESPONSE_BYTES.observe(size, route)
+
+def attachment(generator, mimetype, filename, export_format):
+    """Stream a generator of byte chunks as a file download"""
+    generator = measured_export(generator, export_format, request.url_rule.rule)
+    return Response(generator, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'X-Accel-Buffering': 'no'  # Let the first chunks through a reverse proxy right away
+    })
+
+@app.route('/export_csv', methods=['GET'])
+def export_csv():
+    snapshot = get_heat(requested_heat_id()).snapshot
+    with EXPORT_SECONDS.timer('csv'):
+        data = csv_bytes(heat_csv_rows(snapshot.data, snapshot.rankings))
+    filename = export_filename(snapshot.data.metadata, 'csv')
     
     return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
+        io.BytesIO(data),
         mimetype='text/csv',
         as_attachment=True,
         download_name=filename
     )
 
+@app.route('/export_event_csv', methods=['GET'])
+def export_event_csv():
+    """Every heat's grid and results in one CSV, streamed heat by heat"""
+    timestamp = datetime.now()
+    
+    def generate():
+        yield csv_bytes([['EVENT EXPORT'], ['Generated:', timestamp.strftime('%Y-%m-%d %H:%M:%S')], []])
+        for heat_id, _, _ in all_heats():
+            rows = heat_export_rows(heat_id)
+            if rows is not None:
+                yield csv_bytes([['HEAT', heat_id]] + rows + [[]])
+    
+    return attachment(generate(), 'text/csv', f"KSS_Event_{timestamp.strftime('%Y%m%d_%H%M%S')}.csv", 'event_csv')
+
+@app.route('/export_event_zip', methods=['GET'])
+def export_event_zip():
+    """A ZIP with one CSV per heat, each member streamed out as soon as it is written"""
+    timestamp = datetime.now()
+    
+    def generate():
+        sink = StreamSink()
+        # The sink cannot seek, so zipfile writes each member's sizes after its data
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for heat_id, _, _ in all_heats():
+                rows = heat_export_rows(heat_id)
+                if rows is None:
+                    continue
+                with archive.open(f'{heat_id}.csv', 'w') as member:
+                    member.write(csv_bytes(rows))
+                yield sink.drain()
+        yield sink.drain()  # Central directory
+    
+    return attachment(generate(), 'application/zip', f"KSS_Event_{timestamp.strftime('%Y%m%d_%H%M%S')}.zip",
+                      'event_zip')
+
+@app.route('/export_session_csv', methods=['GET'])
+def export_session_csv():
+    """Every athlete's heat totals (all of them) and aggregates, streamed athlete by athlete"""
+    timestamp = datetime.now()
+    # At least the six heat columns coaches are used to, more if anyone has more heats
+    heat_columns = max(6, state_store.max_heats())
+    
+    def generate():
+        # Header
+        yield csv_bytes([
+            ['SESSION PERFORMANCE TRACKER'],
+            ['Generated:', timestamp.strftime('%Y-%m-%d %H:%M:%S')],
+            [],
+            ['Surfer Name'] + [f'Heat {i+1}' for i in range(heat_columns)]
+            + ['Average', 'Goal Score', 'Best Score', 'Status']
+        ])
+        
+        # Data rows, sent a hundred athletes at a time
+        rows = []
+        for athlete, heats in state_store.iter_totals():
+            heat_scores = [f"{total:.2f}" for _, total in heats[:heat_columns]]
+            heat_scores += ['-'] * (heat_columns - len(heat_scores))
+            avg_score, goal, best_score = athlete['mean'], athlete['goal'], athlete['best']
+            rows.append([athlete['name']] + heat_scores + [
+                f"{avg_score:.2f}" if avg_score > 0 else '-',
+                f"{goal:.1f}" if goal > 0 else '-',
+                f"{best_score:.2f}" if best_score > 0 else '-',
+                athlete['status']
+            ])
+            if len(rows) == 100:
+                yield csv_bytes(rows)
+                rows = []
+        yield csv_bytes(rows)
+    
+    return attachment(generate(), 'text/csv', f"KSS_Session_{timestamp.strftime('%Y%m%d_%H%M%S')}.csv",
+                      'session_csv')
+
 @app.route('/export_pdf', methods=['GET'])
 def export_pdf():
-    results = calculate_rankings()
-    
-    # Create PDF in memory
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elements = []
-    
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title = Paragraph(f"<b>KSS - Heat Results</b>", styles['Title'])
-    elements.append(title)
-    elements.append(Spacer(1, 6))
-    
-    subtitle = Paragraph(f"<i>Karibe Surf Score Judging System</i>", styles['Normal'])
-    elements.append(subtitle)
-    elements.append(Spacer(1, 12))
-    
-    round_title = Paragraph(f"<b>{current_heat['metadata']['round']}</b>", styles['Heading2'])
-    elements.append(round_title)
-    elements.append(Spacer(1, 12))
-    
-    # Metadata
-    meta_text = f"Heat: {current_heat['metadata']['heat_number']} | Category: {current_heat['metadata']['category']} | Round: {current_heat['metadata']['round']}"
-    meta = Paragraph(meta_text, styles['Normal'])
-    elements.append(meta)
-    
-    location_text = f"Location: {current_heat['metadata']['location']} | Duration: {current_heat['metadata']['duration']} min"
-    location = Paragraph(location_text, styles['Normal'])
-    elements.append(location)
-    elements.append(Spacer(1, 12))
-    
-    # Notes if present
-    if current_heat['metadata']['notes']:
-        notes_text = f"<b>Notes:</b> {current_heat['metadata']['notes']}"
-        notes = Paragraph(notes_text, styles['Normal'])
-        elements.append(notes)
-        elements.append(Spacer(1, 20))
-    else:
-        elements.append(Spacer(1, 8))
-    
-    # Full scoring grid (limited to waves that were actually used)
-    grid_title = Paragraph("<b>Full Scoring Grid</b>", styles['Heading2'])
-    elements.append(grid_title)
-    elements.append(Spacer(1, 8))
-    
-    # Determine max wave used
-    max_wave_idx = 0
-    for surfer in current_heat['surfers']:
-        for idx, wave in enumerate(surfer['waves']):
-            if wave is not None:
-                max_wave_idx = max(max_wave_idx, idx)
-    
-    # Show up to max_wave_idx + 1, minimum 12
-    num_waves = max(12, max_wave_idx + 1)
-    
-    grid_data = [['Surfer'] + [f'W{i+1}' for i in range(num_waves)]]
-    for surfer in current_heat['surfers']:
-        row = [surfer['color']]
-        for i in range(num_waves):
-            wave = surfer['waves'][i] if i < len(surfer['waves']) else None
-            row.append(f"{wave:.1f}" if wave is not None else '-')
-        grid_data.append(row)
-    
-    grid_table = Table(grid_data)
-    grid_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    elements.append(grid_table)
-    elements.append(Spacer(1, 20))
-    
-    # Final results section
-    results_title = Paragraph("<b>Final Results</b>", styles['Heading2'])
-    elements.append(results_title)
-    elements.append(Spacer(1, 8))
-    
-    # Results table
-    data = [['Position', 'Surfer', 'Best Wave', '2nd Wave', 'Total', 'Interference']]
-    
-    interference_labels = {
-        0: 'None',
-        1: 'INT-1',
-        2: 'INT-2',
-        3: 'INT-3',
-        4: '2x INT',
-        5: '2x INT',
-        6: 'DQ'
-    }
-    
-    for result in results:
-        waves = result['top_waves'] + [None] * (2 - len(result['top_waves']))
-        interference_label = interference_labels.get(result['interference'], 'None')
-        data.append([
-            str(result['position']),
-            result['color'],
-            f"{waves[0]:.2f}" if waves[0] is not None else '-',
-            f"{waves[1]:.2f}" if waves[1] is not None else '-',
-            f"{result['total']:.2f}",
-            interference_label
-        ])
-    
-    table = Table(data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    elements.append(table)
-    doc.build(elements)
-    
-    buffer.seek(0)
-    
-    # Create filename: category_heatnumber (e.g., "OpenMen_H1")
-    category_clean = current_heat['metadata']['category'].replace(' ', '') if current_heat['metadata']['category'] else 'Category'
-    heat_clean = current_heat['metadata']['heat_number'].replace(' ', '') if current_heat['metadata']['heat_number'] else 'Heat'
-    filename = f"{category_clean}_H{heat_clean}.pdf"
-    
-    return send_file(
-        buffer,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=filename
-    )
+    """Heat sheet PDF; waits up to ?wait= seconds for the render, else 202 with the job"""
+    heat = get_heat(requested_heat_id())
+    job = pdf_renderer.request(heat)
+    return pdf_job_response(job, job.wait(requested_wait(PDF_MAX_WAIT)))
+
+@app.route('/pdf_jobs', methods=['POST'])
+def start_pdf_job():
+    """Start (or reuse) the heat sheet render for the heat's current version"""
+    heat = get_heat(requested_heat_id())
+    job = pdf_renderer.request(heat)
+    status = job.wait(requested_wait(0))
+    return jsonify(job.to_dict()), 200 if status == 'done' else 202
+
+@app.route('/pdf_jobs/<job_id>', methods=['GET'])
+def pdf_job_status(job_id):
+    """Poll a render job; ?wait= blocks up to that many seconds for it to finish"""
+    job = pdf_renderer.job(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown PDF job: {job_id}'}), 404
+    job.wait(requested_wait(0))
+    return jsonify(job.to_dict())
+
+@app.route('/pdf_jobs/<job_id>/pdf', methods=['GET'])
+def pdf_job_download(job_id):
+    job = pdf_renderer.job(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown PDF job: {job_id}'}), 404
+    return pdf_job_response(job, job.wait(requested_wait(0)))
+
+@app.before_request
+def note_request_start():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The rule, not the path, so per-heat and per-job URLs share one series
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        elapsed = time.perf_counter() - started
+        REQUEST_SECONDS.observe(elapsed, route, request.method)
+        if response.content_length is not None:
+            RESPONSE_BYTES.observe(response.content_length, route)
+        if len(startup_phases) == startup_phase_count:
+            startup_phases.append(('first_request', elapsed))
+            if STARTUP_REPORT:
+                print(f'startup: first request ({route}) {elapsed * 1000:.1f} ms', file=sys.stderr)
+    return response
+
+def render_metrics():
+    """Every histogram and gauge in the Prometheus text exposition format"""
+    with heats_lock:
+        resident = list(heats.values())
+    open_heats = sum(1 for heat in resident if not heat.snapshot.data.metadata.get('is_closed'))
+    subscribers = sum(heat.feed.subscribers for heat in resident)
+    pdf_jobs = pdf_renderer.job_counts()
+    
+    lines = []
+    for histogram in (REQUEST_SECONDS, RESPONSE_BYTES, RANKING_SECONDS, EXPORT_SECONDS):
+        lines.extend(histogram.render())
+    lines += ['# HELP surf_judge_startup_seconds Time spent in each startup phase',
+              '# TYPE surf_judge_startup_seconds gauge']
+    lines += [f'surf_judge_startup_seconds{{phase="{phase}"}} {seconds:.6f}' for phase, seconds in startup_phases]
+    for name, description, value in (
+        ('surf_judge_resident_heats', 'Heats loaded in this process', len(resident)),
+        ('surf_judge_open_heats', 'Resident heats that are not closed', open_heats),
+        ('surf_judge_stream_subscribers', 'Connected /stream clients', subscribers),
+        ('surf_judge_profiler_enabled', 'Whether the sampling profiler is running', int(profiler.enabled)),
+    ):
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} gauge', f'{name} {value}']
+    lines += ['# HELP surf_judge_pdf_jobs Cached PDF render jobs by status', '# TYPE surf_judge_pdf_jobs gauge']
+    lines += [f'surf_judge_pdf_jobs{{status="{status}"}} {pdf_jobs[status]}'
+              for status in ('pending', 'done', 'failed')]
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/profiler', methods=['GET'])
+def profiler_stacks():
+    """The sampled stacks in folded form (?format=json for the profiler status)"""
+    if request.args.get('format') == 'json':
+        return jsonify(profiler.to_dict())
+    return Response(profiler.folded(), mimetype='text/plain')
+
+@app.route('/profiler', methods=['POST'])
+def toggle_profiler():
+    """Switch the sampling profiler on or off: {"enabled": true, "interval": 0.005, "reset": true}"""
+    data = request.get_json(silent=True) or {}
+    interval = data.get('interval')
+    if interval is not None and (isinstance(interval, bool) or not isinstance(interval, (int, float))
+                                 or not 0.001 <= interval <= 1):
+        return jsonify({'error': 'interval must be between 0.001 and 1 second'}), 400
+    if data.get('reset'):
+        profiler.reset()
+    if data.get('enabled') is True:
+        profiler.start(interval)
+    elif data.get('enabled') is False:
+        profiler.stop()
+    elif interval is not None:
+        profiler.interval = interval
+    return jsonify(profiler.to_dict())
+
+if os.environ.get('SURF_JUDGE_PROFILE') and __name__ != '__mp_main__':
+    profiler.start()
+
+def warm_templates():
+    """Compile every template now (or load it from the bytecode cache), so the
+    first page load does not wait for Jinja"""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+STARTUP_REPORT = os.environ.get('SURF_JUDGE_STARTUP_REPORT') == '1'  # Print the phases to stderr
+
+startup_phase('routes')
+if __name__ != '__mp_main__':
+    warm_templates()
+    startup_phase('templates')
+startup_phases.append(('total', time.perf_counter() - STARTED))
+startup_phase_count = len(startup_phases)
+if STARTUP_REPORT and __name__ != '__mp_main__':
+    print('startup: ' + ', '.join(f'{phase} {seconds * 1000:.1f} ms' for phase, seconds in startup_phases),
+          file=sys.stderr)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,51 @@
+"""
+Live forecasts for heats with odd metadata.
+
+    python -m unittest test_forecast
+"""
+
+import os
+import unittest
+
+os.environ['SURF_JUDGE_STATE'] = 'memory'
+os.environ.pop('SURF_JUDGE_JOURNAL', None)
+
+import surf_judge_pro
+from surf_judge_pro import app, heat_minutes, heat_remaining, run_operation
+
+class BadDurationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.heat_id = f'duration-{self._testMethodName}'[:48]
+        self.client.post('/heats', json={'heat_id': self.heat_id, 'surfer_count': 2})
+        # Simulate in the request, without starting a process pool
+        workers = surf_judge_pro.forecaster.workers
+        surf_judge_pro.forecaster.workers = 1
+        self.addCleanup(setattr, surf_judge_pro.forecaster, 'workers', workers)
+
+    def update(self, metadata):
+        return self.client.post(f'/update_metadata?heat_id={self.heat_id}', json=metadata)
+
+    def test_update_metadata_rejects_a_bad_duration(self):
+        for duration in ('abc', '20', 0, -5, None, True, [20]):
+            self.assertEqual(self.update({'duration': duration}).status_code, 400, duration)
+        self.assertEqual(self.update({'duration': 25}).status_code, 200)
+        self.assertEqual(self.update({'duration': 12.5}).status_code, 200)
+
+    def test_forecast_falls_back_to_twenty_minutes(self):
+        # Stored before durations were checked
+        run_operation(self.heat_id, {'op': 'update_metadata', 'metadata': {'duration': 'abc'}})
+        response = self.client.get(f'/get_forecast?heat_id={self.heat_id}&simulations=100')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['remaining_seconds'], 20 * 60)
+
+    def test_helpers_fall_back_to_twenty_minutes(self):
+        for duration in ('abc', None, 0, -1, float('nan'), float('inf'), [20]):
+            self.assertEqual(heat_minutes({'duration': duration}), 20.0, duration)
+            self.assertEqual(heat_remaining({'duration': duration}), 1200.0, duration)
+        self.assertEqual(heat_minutes({'duration': '15'}), 15.0)
+        self.assertEqual(heat_remaining({'duration': 30}), 1800.0)
+
+if __name__ == '__main__':
+    unittest.main()